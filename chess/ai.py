@@ -1,102 +1,900 @@
+import os
 import sys
+import time
+import multiprocessing
 from random import shuffle, randint
 import numpy as np
-import torch
+from tt import TranspositionTable, exact, lower, upper
+from bitboard import Bits
+from evalcache import EvalCache
+import tablebase
+import book
 
 '''
 model = torch.jit.load('nn7EndGame1000_scripted.pt')
 model.eval()
 '''
-mode="all pieces"
+#torch is only imported, and models only loaded, when a position is first evaluated with the network (see getModel),
+#so importing this module is cheap for tools that never evaluate anything.
+torch=None
+mode="all pieces" #change with setMode
+modelFiles={"all pieces":'nn7EndGame1000_scripted.pt',"rooks only":'nnGMNeil1000_scripted.pt'}
+models={} #file -> loaded model
 
-if mode=="all pieces":
-    model=torch.jit.load('nn7EndGame1000_scripted.pt')
-elif mode=="rooks only":
-    model=torch.jit.load('nnGMNeil1000_scripted.pt')
-model.eval()
+#Evaluator backends, chosen with setEvaluator:
+#"network": the model for the current mode.
+#"material": minus the material balance (Board.score), for running the search without torch.
+#Lower values are better for the player who picked the root move, whichever backend is used.
+evaluator="network"
 
-def value(board):
+def importTorch():
+    global torch
+    if torch==None:
+        import torch as module
+        torch=module
+    return torch
+
+#returns the model stored in the given TorchScript file, loading it the first time it is asked for
+def loadModel(path):
+    if path not in models:
+        importTorch()
+        model=torch.jit.load(path)
+        model.eval()
+        for parameter in model.parameters():
+            parameter.requires_grad_(False) #needed to run the model under torch.inference_mode
+        models[path]=model
+    return models[path]
+
+#returns the model for the given mode (default: the current one)
+def getModel(forMode=None):
+    if forMode==None:
+        forMode=mode
+    return loadModel(modelFiles[forMode])
+
+#makes the network evaluator use the model in the given file, switching to the mode whose features it takes
+def setModelFile(path):
+    width=next(loadModel(path).parameters()).shape[1]
+    for m in featureCount:
+        if featureCount[m]==width:
+            modelFiles[m]=path
+            setMode(m)
+            return
+    raise Exception("Model "+str(path)+" takes "+str(width)+" features. Expected one of "+", ".join(str(n) for n in featureCount.values())+".")
+
+def setMode(newMode):
+    global mode
+    if newMode not in modelFiles:
+        raise Exception("Unknown mode "+str(newMode)+". Expected one of "+", ".join(modelFiles)+".")
+    mode=newMode
+    setBatchSize(batchSize) #the number of features depends on the mode
+    table.clear() #stored scores came from the old model
+    evalCache.clear()
+
+def setEvaluator(name):
+    global evaluator
+    if name not in ("network","material"):
+        raise Exception("Unknown evaluator "+str(name)+". Expected \"network\" or \"material\".")
+    evaluator=name
+    table.clear()
+
+useTable=True #whether minimax uses the transposition table
+table=TranspositionTable(16) #resize with table.resize(mb); clear with table.clear() between games
+nodes=0 #number of positions visited by minimax since the last pickMove
+useEvalCache=True #whether network evaluations are looked up in (and added to) evalCache
+evalCache=EvalCache(1<<16) #resize with evalCache.resize(entries)
+
+useTablebase=True #whether the network evaluator looks positions up in the endgame tables (see tablebase.py) first
+drawValue=100.0 #value of a drawn table position for the side with the pieces (worse than any win)
+tableScore=10000.0 #table mates score plies/2-tableScore for the root player mating, tableScore-plies/2 for it being mated
+rootInTables=False #whether the tables cover the root of the current search (see tablebaseValue), set by setTableRoot
+useBook=True #whether pickMove first plays a move from the opening book in bookFile (see book.py), if there is one
+bookFile="book.bin"
+openingBook=None #the Book, opened on first use; False if bookFile does not exist
+
+def getBook():
+    global openingBook
+    if openingBook==None:
+        openingBook=book.Book(bookFile) if os.path.exists(bookFile) else False
+    return openingBook
+
+#opens bookFile again on next use -- call after changing or rebuilding it
+def setBookFile(path):
+    global bookFile,openingBook
+    bookFile=path
+    openingBook=None
+
+featureCount={"all pieces":14,"rooks only":8}
+
+#returns the list of features the model takes for the given board: (x,y) coordinates, counted from 1,
+#of the white king, black king, then (all pieces mode) queen, two rooks and two bishops, or (rooks only mode) two rooks.
+#missing pieces are given coordinates (0,0).
+def features(board):
+    #column by column, matching the order the models were trained with
+    flat=board.squares.T.ravel().tolist()
+    wKing=[]
+    bKing=[]
+    queen=[]
+    rooks=[]
+    bishops=[]
+    pieces={9:wKing,-9:bKing,5:rooks}
+    if mode=="all pieces":
+        pieces[8]=queen
+        pieces[3]=bishops
+    for i in range(64):
+        p=flat[i]
+        if p in pieces:
+            pieces[p].append(((i>>3)+1,(i&7)+1))
+    if (len(wKing),len(bKing))!=(1,1):
+        raise Exception("Incorrect number of kings. Expected 1 white king, 1 black king. Got "+str(len(wKing))+" white kings and "+str(len(bKing))+" black kings.")
     if mode=="all pieces":
-        positions=[(board.squares[y][x],x+1,y+1) for x in range(8) for y in range(8) if board.squares[y][x]!=0]
-        wKing=[(x,y) for (p,x,y) in positions if p==9]
-        bKing=[(x,y) for (p,x,y) in positions if p==-9]
-        queen=[(x,y) for (p,x,y) in positions if p==8]
-        rooks=[(x,y) for (p,x,y) in positions if p==5]
-        bishops=[(x,y) for (p,x,y) in positions if p==3]
-        counts=[len(x) for x in [wKing,bKing,queen,rooks,bishops]]
-        if (counts[0],counts[1])!=(1,1):
-            raise Exception("Incorrect number of kings. Expected 1 white king, 1 black king. Got "+str(counts[0])+" white kings and "+str(counts[1])+" black kings.")
-        if counts[2]>1 or counts[3]>2 or counts[4]>2:
-            raise Exception("Incorrect number of pieces. Expected 0-1 queens, 0-2 rooks, and 0-2 bishops. Got "+str(count[2])+" queens, "+str(count[3])+" rooks, and "+str(count[4])+" bishops.")
-        if counts[2]==0:
+        if len(queen)>1 or len(rooks)>2 or len(bishops)>2:
+            raise Exception("Incorrect number of pieces. Expected 0-1 queens, 0-2 rooks, and 0-2 bishops. Got "+str(len(queen))+" queens, "+str(len(rooks))+" rooks, and "+str(len(bishops))+" bishops.")
+        if len(queen)==0:
             queen.append((0,0))
-        while len(rooks)<2:
-            rooks.append((0,0))
         while len(bishops)<2:
             bishops.append((0,0))
-        array=[wKing[0][0],wKing[0][1],
-               bKing[0][0],bKing[0][1],
-               queen[0][0],queen[0][1],
-               rooks[0][0],rooks[0][1],
-               rooks[1][0],rooks[1][1],
-               bishops[0][0],bishops[0][1],
-               bishops[1][0],bishops[1][1]]
-        array=torch.tensor(array).float()
-        r=model(array)
-    elif mode=="rooks only":
-        positions=[(board.squares[y][x],x+1,y+1) for x in range(8) for y in range(8) if board.squares[y][x]!=0]
-        wKing=[(x,y) for (p,x,y) in positions if p==9]
-        bKing=[(x,y) for (p,x,y) in positions if p==-9]
-        rooks=[(x,y) for (p,x,y) in positions if p==5]
-        counts=[len(x) for x in [wKing,bKing,rooks]]
-        if (counts[0],counts[1])!=(1,1):
-            raise Exception("Incorrect number of kings. Expected 1 white king, 1 black king. Got "+str(counts[0])+" white kings and "+str(counts[1])+" black kings.")
-        if counts[2]>2:
-            raise Exception("Incorrect number of pieces. Expected at most 1 rook. Got "+str(count[2])+" rooks.")
-        while len(rooks)<2:
-            rooks.append((0,0))
-        array=[wKing[0][0],wKing[0][1],
-               bKing[0][0],bKing[0][1],
-               rooks[0][0],rooks[0][1],
-               rooks[1][0],rooks[1][1]]
-        array=torch.tensor(array).float()
-        r=model(array)
-    return r
-
-def minimax(board,depth,maximizing=True,alpha=-sys.maxsize,beta=sys.maxsize,whiteTurn=False):
+    elif len(rooks)>2:
+        raise Exception("Incorrect number of pieces. Expected at most 2 rooks. Got "+str(len(rooks))+" rooks.")
+    while len(rooks)<2:
+        rooks.append((0,0))
+    ret=[wKing[0][0],wKing[0][1],
+         bKing[0][0],bKing[0][1]]
+    if mode=="all pieces":
+        ret+=[queen[0][0],queen[0][1]]
+    ret+=[rooks[0][0],rooks[0][1],
+          rooks[1][0],rooks[1][1]]
+    if mode=="all pieces":
+        ret+=[bishops[0][0],bishops[0][1],
+              bishops[1][0],bishops[1][1]]
+    return ret
+
+#returns the features of the board for the network and the sign to give its output. The networks were trained on
+#positions seen from the side with the pieces, so when the board's own side has nothing but its king, the features
+#are those of the flipped board and the output is negated (what is good for the opponent is bad for the player).
+def evalFeatures(board):
+    s=board.squares
+    if (s>0).sum()==1 and (s<0).sum()>1:
+        board.flip()
+        f=features(board)
+        board.flip()
+        return (f,-1.0)
+    return (features(board),1.0)
+
+def value(board):
+    if evaluator=="material":
+        return -float(board.score())
+    f,sign=evalFeatures(board)
+    if useEvalCache:
+        key=tuple(f)
+        v=evalCache.get(key)
+        if v!=None:
+            return sign*v
+    model=getModel()
+    with torch.inference_mode():
+        v=float(model(torch.tensor(f).float()))
+    if useEvalCache:
+        evalCache.put(key,v)
+    return sign*v
+
+#returns the value of the position from its endgame table, or None if there is no table for it or they are not used.
+#rootToMove tells whether the player who picked the root move is to move. The tables count exact moves to mate and
+#the networks only estimate them, on a different scale, so table mates are kept in a band of their own outside the
+#networks' range (see tableScore): a mate the tables prove is better than any the networks guess, nearer ones better
+#still, and being mated is worse than anything. Draws are worth drawValue.
+#Table mates are only used when the tables cover the root too. Below a root they do not cover, a table position is
+#only ever reached by the lone king capturing a piece, and a proven mate there would always look worse to it than the
+#networks' guesses for keeping its distance, so the search would stop seeing any cost in leaving pieces to be taken.
+#There, table mates are left to the networks and only table draws are used.
+def tablebaseValue(board,rootToMove):
+    if not useTablebase or evaluator!="network":
+        return None
+    r=tablebase.probe(board,1 if rootToMove else -1)
+    if r==None:
+        return None
+    result,plies=r
+    if result==0:
+        return drawValue if (board.squares>0).sum()>1 else -drawValue
+    if not rootInTables:
+        return None
+    if not rootToMove:
+        result=-result
+    return -result*(tableScore-plies/2) #result is now 1 if the root player mates, -1 if it is mated
+
+#sets rootInTables for a search from board, its root. The values the table stores depend on it, so the table is
+#cleared when it changes.
+def setTableRoot(board):
+    global rootInTables
+    covered=useTablebase and evaluator=="network" and tablebase.probe(board)!=None
+    if covered!=rootInTables:
+        rootInTables=covered
+        table.clear()
+
+#Leaf batching: minimax evaluates the children of depth 1 nodes batchSize at a time, encoding them into
+#one preallocated float32 array and running the model once per batch. A batch size of 1 evaluates each leaf
+#on its own. Larger batches mean fewer model calls, but may evaluate leaves alpha-beta would have skipped.
+def setBatchSize(n):
+    global batchSize,batch,batchTensor
+    batchSize=max(1,n)
+    batch=np.zeros((batchSize,featureCount[mode]),dtype=np.float32)
+    batchTensor=None #made from batch by evaluateBatch, so torch is not needed until then
+
+setBatchSize(32)
+
+#evaluates the first n rows of batch, returning a list of floats
+def evaluateBatch(n):
+    global batchTensor
+    model=getModel()
+    if batchTensor is None:
+        batchTensor=torch.from_numpy(batch) #shares memory with batch
+    with torch.inference_mode():
+        return model(batchTensor[:n])[:,0].tolist()
+
+#Move ordering: the move from the previous iteration's principal variation (or the transposition table) first,
+#then captures by most valuable victim / least valuable attacker, promotions, two killer moves per ply
+#(quiet moves that caused a cutoff at the same ply) and finally quiet moves by the history heuristic.
+pieceValue={1:1,2:3,3:3,5:5,8:9,9:20}
+killers=[[0,0] for i in range(64)] #packed moves, per ply
+history=[[0]*4096,[0]*4096] #per side (whiteTurn), indexed by start+64*end
+pvTable=[[] for i in range(65)] #best line found from each ply in the current iteration
+
+#sorts moves best first. board must be seen from the side to move.
+def orderMoves(board,moves,ply,whiteTurn,first=0):
+    flat=board.squares.ravel().tolist()
+    k1,k2=killers[ply] if ply<len(killers) else (0,0)
+    h=history[whiteTurn]
+    def score(move):
+        p=move.pack()
+        if p==first:
+            return 1<<30
+        if move.captured:
+            return (1<<24)+(pieceValue[-move.captured]<<8)-pieceValue[flat[move.start]]
+        if move.promotion:
+            return (1<<23)+move.promotion
+        if p==k1:
+            return (1<<22)+1
+        if p==k2:
+            return 1<<22
+        return h[p&4095]
+    moves.sort(key=score,reverse=True)
+
+#records a quiet move that caused a beta cutoff
+def cutoff(move,ply,depth,whiteTurn):
+    if move.captured or move.promotion:
+        return
+    p=move.pack()
+    if ply<len(killers) and killers[ply][0]!=p:
+        killers[ply]=[p,killers[ply][0]]
+    history[whiteTurn][p&4095]+=depth*depth
+
+#Search limits, set by pickMove. Once either is reached, stopped is set and the search unwinds
+#(restoring the board) without storing anything; the unfinished iteration's results are only used
+#for root moves that were searched to completion.
+deadline=None #time.perf_counter() value
+nodeLimit=None
+stopped=False
+#set from another thread to stop the search running in a background thread (see engine.py) as soon as possible.
+#unlike the limits above, pickMove does not reset it; whoever sets it clears it before the next search.
+cancelled=False
+
+def checkLimits():
+    global stopped
+    if cancelled or (nodeLimit and nodes>=nodeLimit) or (deadline and time.perf_counter()>deadline):
+        stopped=True
+    return stopped
+
+#Search extensions, each behind a switch (clear the table after changing one):
+#Quiescence: instead of evaluating a depth 0 position directly, the side to move may either stand pat (take the
+#static value) or try captures and promotions, up to quiescenceDepth plies deep, so leaves are only evaluated once
+#nothing hangs. Positions in check are searched with all their moves, since standing pat is not an option there.
+useQuiescence=False
+quiescenceDepth=6
+#Null move pruning: at depth>=nullMoveReduction+1, the side to move first passes and the rest is searched
+#nullMoveReduction plies shallower. If even that is outside the window, the node is cut off without searching its
+#moves. Not tried in check, on the principal variation or for a side with nothing but its king (zugzwang).
+useNullMove=False
+nullMoveReduction=2
+#Late move reductions: at depth>=3, quiet moves after the first lateMoveStart are searched one ply shallower,
+#and searched again at full depth if they turn out to raise alpha (lower beta for the minimizing side).
+useLateMoveReductions=False
+lateMoveStart=3
+
+#searches the captures (and promotions) of the position, as described above. maximizing, alpha, beta and whiteTurn
+#are as in minimax. standPat is the static value of the position, if already known.
+def quiesce(board,maximizing,alpha,beta,whiteTurn,ply,qDepth,standPat=None):
+    global nodes
+    if checkLimits():
+        return 0.0
+    r=tablebaseValue(board,whiteTurn)
+    if r!=None:
+        return r
     if not whiteTurn:
         board.flip()
-    boards=board.allMoves()
+    bits=Bits(board.squares)
+    inCheck=bits.inCheck()
     if not whiteTurn:
         board.flip()
-        [board.flip() for board in boards]
-    #if not whiteTurn:
-    #    board.flip()
-    if depth==0 or len(boards)==0:
-        v=value(board)
-        return value(board)
-    if maximizing:
-        v=-sys.maxsize
-        for board in boards:
-            v=max(v,minimax(board,depth-1,False,alpha,beta,not whiteTurn))
+    if inCheck and qDepth>0:
+        v=-sys.maxsize if maximizing else sys.maxsize
+    else:
+        v=standPat if standPat!=None else float(value(board))
+        if qDepth==0:
+            return v
+        #standing pat is already good enough to cut off, so no captures need generating
+        if maximizing:
+            if v>beta:
+                return v
+            alpha=max(alpha,v)
+        else:
+            if v<alpha:
+                return v
+            beta=min(beta,v)
+    if not whiteTurn:
+        board.flip()
+    moves=bits.legalMoves(board.moved,board.enPassant,captures=not inCheck)
+    orderMoves(board,moves,ply,whiteTurn)
+    if not whiteTurn:
+        board.flip()
+    if not moves:
+        return v if not inCheck else float(value(board))
+    for move in moves:
+        if not whiteTurn:
+            board.flip()
+        board.make(move)
+        if not whiteTurn:
+            board.flip()
+        nodes+=1
+        r=quiesce(board,not maximizing,alpha,beta,not whiteTurn,ply+1,qDepth-1)
+        if not whiteTurn:
+            board.flip()
+        board.unmake(move)
+        if not whiteTurn:
+            board.flip()
+        if stopped:
+            return v
+        if maximizing:
+            v=max(v,r)
             if v>beta:
                 break
             alpha=max(alpha,v)
+        else:
+            v=min(v,r)
+            if v<alpha:
+                break
+            beta=min(beta,v)
+    return v
+
+#searches the given moves of a depth 1 node, evaluating the resulting leaves in batches.
+#returns the node's value and best move, as the loop in minimax would.
+def searchLeaves(board,moves,maximizing,alpha,beta,whiteTurn,ply):
+    global nodes
+    if maximizing:
+        v=-sys.maxsize
+    else:
+        v=sys.maxsize
+    bestMove=moves[0]
+    for c in range(0,len(moves),batchSize):
+        if checkLimits():
+            break
+        chunk=moves[c:c+batchSize]
+        scores=[None]*len(chunk)
+        static=[False]*len(chunk) #whether scores[i] is the leaf's static value, which quiescence may change
+        pending=[] #(index in chunk, hash, features, sign) of the leaves written to batch
+        for i in range(len(chunk)):
+            move=chunk[i]
+            if not whiteTurn:
+                board.flip()
+            board.make(move)
+            if not whiteTurn:
+                board.flip()
+            nodes+=1
+            entry=table.probe(board.hash) if useTable else None
+            r=tablebaseValue(board,not whiteTurn)
+            if r!=None:
+                scores[i]=r
+            elif entry and entry[2]==exact:
+                scores[i]=entry[1]
+            else:
+                f,sign=evalFeatures(board)
+                key=tuple(f)
+                r=evalCache.get(key) if useEvalCache else None
+                static[i]=True
+                if r!=None:
+                    scores[i]=sign*r
+                    if useTable and not useQuiescence:
+                        table.store(board.hash,0,sign*r,exact)
+                else:
+                    batch[len(pending)]=f
+                    pending.append((i,board.hash,key,sign))
+            if not whiteTurn:
+                board.flip()
+            board.unmake(move)
+            if not whiteTurn:
+                board.flip()
+        if pending:
+            for (i,h,key,sign),r in zip(pending,evaluateBatch(len(pending))):
+                if useEvalCache:
+                    evalCache.put(key,r)
+                r*=sign
+                scores[i]=r
+                if useTable and not useQuiescence:
+                    table.store(h,0,r,exact)
+        for move,r,quiet in zip(chunk,scores,static):
+            if quiet and useQuiescence:
+                if not whiteTurn:
+                    board.flip()
+                board.make(move)
+                if not whiteTurn:
+                    board.flip()
+                r=quiesce(board,not maximizing,alpha,beta,not whiteTurn,ply+1,quiescenceDepth,r)
+                if not whiteTurn:
+                    board.flip()
+                board.unmake(move)
+                if not whiteTurn:
+                    board.flip()
+                if stopped:
+                    return (v,bestMove)
+            if maximizing:
+                if r>v:
+                    v=r
+                    bestMove=move
+                    pvTable[ply]=[move]
+                if v>beta:
+                    cutoff(move,ply,1,whiteTurn)
+                    return (v,bestMove)
+                alpha=max(alpha,v)
+            else:
+                if r<v:
+                    v=r
+                    bestMove=move
+                    pvTable[ply]=[move]
+                if v<alpha:
+                    cutoff(move,ply,1,whiteTurn)
+                    return (v,bestMove)
+                beta=min(beta,v)
+    return (v,bestMove)
+
+#board is always seen from the perspective of the player who picked the root move (see pickMove),
+#and is searched in place with make/unmake -- it is unchanged when minimax returns.
+#ply is the distance from the root, and pvLine the rest of the previous iteration's principal variation
+#if this node is on it.
+def minimax(board,depth,maximizing=True,alpha=-sys.maxsize,beta=sys.maxsize,whiteTurn=False,ply=1,pvLine=None):
+    global nodes
+    nodes+=1
+    pvTable[ply]=[]
+    if checkLimits():
+        return 0.0
+    r=tablebaseValue(board,whiteTurn)
+    if r!=None:
+        return r
+    best=0
+    if useTable:
+        entry=table.probe(board.hash)
+        if entry:
+            d,score,bound,best=entry
+            if d>=depth and not pvLine:
+                if bound==exact:
+                    return score
+                if bound==lower:
+                    alpha=max(alpha,score)
+                else:
+                    beta=min(beta,score)
+                if alpha>=beta:
+                    return score
+    alpha0,beta0=alpha,beta
+    if depth==0:
+        if useQuiescence:
+            v=quiesce(board,maximizing,alpha,beta,whiteTurn,ply,quiescenceDepth)
+            if useTable and not stopped:
+                table.store(board.hash,0,v,upper if v<=alpha0 else lower if v>=beta0 else exact)
+            return v
+        v=float(value(board))
+        if useTable:
+            table.store(board.hash,0,v,exact)
+        return v
+    if not whiteTurn:
+        board.flip()
+    bits=Bits(board.squares)
+    moves=bits.legalMoves(board.moved,board.enPassant)
+    inCheck=bits.inCheck()
+    orderMoves(board,moves,ply,whiteTurn,pvLine[0].pack() if pvLine else best)
+    if not whiteTurn:
+        board.flip()
+    if len(moves)==0:
+        v=float(value(board))
+        if useTable:
+            table.store(board.hash,depth,v,exact)
         return v
+    if (useNullMove and depth>nullMoveReduction and not inCheck and not pvLine
+            and (beta<sys.maxsize if maximizing else alpha>-sys.maxsize)
+            and ((board.squares>0) if whiteTurn else (board.squares<0)).sum()>1):
+        board.makeNull()
+        r=minimax(board,depth-1-nullMoveReduction,not maximizing,alpha,beta,not whiteTurn,ply+1)
+        board.unmakeNull()
+        if stopped:
+            return r
+        if (maximizing and r>beta) or (not maximizing and r<alpha):
+            return r
+    if maximizing:
+        v=-sys.maxsize
     else:
         v=sys.maxsize
-        for board in boards:
-            v=min(v,minimax(board,depth-1,True,alpha,beta,not whiteTurn))
+    bestMove=moves[0]
+    if depth==1 and batchSize>1 and evaluator=="network":
+        v,bestMove=searchLeaves(board,moves,maximizing,alpha,beta,whiteTurn,ply)
+        moves=[] #already searched
+    for i,move in enumerate(moves):
+        if not whiteTurn:
+            board.flip()
+        board.make(move)
+        if not whiteTurn:
+            board.flip()
+        line=pvLine[1:] if pvLine and pvLine[0]==move else None
+        if (useLateMoveReductions and depth>=3 and i>=lateMoveStart and not inCheck and not line
+                and not move.captured and not move.promotion):
+            r=minimax(board,depth-2,not maximizing,alpha,beta,not whiteTurn,ply+1)
+            if (r>alpha if maximizing else r<beta) and not stopped:
+                r=minimax(board,depth-1,not maximizing,alpha,beta,not whiteTurn,ply+1)
+        else:
+            r=minimax(board,depth-1,not maximizing,alpha,beta,not whiteTurn,ply+1,line)
+        if not whiteTurn:
+            board.flip()
+        board.unmake(move)
+        if not whiteTurn:
+            board.flip()
+        if stopped:
+            return v
+        if maximizing:
+            if r>v:
+                v=r
+                bestMove=move
+                pvTable[ply]=[move]+pvTable[ply+1]
+            if v>beta:
+                cutoff(move,ply,depth,whiteTurn)
+                break
+            alpha=max(alpha,v)
+        else:
+            if r<v:
+                v=r
+                bestMove=move
+                pvTable[ply]=[move]+pvTable[ply+1]
             if v<alpha:
+                cutoff(move,ply,depth,whiteTurn)
                 break
             beta=min(beta,v)
+    if stopped:
         return v
+    if useTable:
+        if v<=alpha0:
+            bound=upper
+        elif v>=beta0:
+            bound=lower
+        else:
+            bound=exact
+        table.store(board.hash,depth,v,bound,bestMove.pack())
+    return v
 
-def pickMove(board,depth):
-    boards=board.allMoves()
-    if len(boards)==0:
+#summary of the last pickMove call: depth completed, value, principal variation (Move objects, alternately
+#seen from each side), nodes searched, seconds taken, (depth, nodes, seconds) after each completed iteration and
+#whether the move came from the opening book (without a search).
+searchInfo={}
+
+#Root-parallel search: with workers>1, pickMove hands each root move to a pool of worker processes.
+#Every root move is searched with a full window, so values are exact and the move picked has the same value
+#the serial search finds at the same depth (ties may be broken differently). Workers are started once, each
+#loading the model a single time, and reused until closePool is called or the settings they were started with change.
+pool=None
+poolSize=0
+poolConfig=None #the workerConfig() the pool was started with
+
+#the module's search switches, which the workers copy along with the settings in workerConfig
+searchSwitches=("useTable","useEvalCache","useTablebase","drawValue","tableScore","useQuiescence","quiescenceDepth","useNullMove",
+                "nullMoveReduction","useLateMoveReductions","lateMoveStart")
+
+#the settings the workers copy from this process when they start. Any change to them (through setMode,
+#setEvaluator, setModelFile, setBatchSize or directly) makes getPool start a new pool, so the workers never
+#search with settings the serial search would not use.
+def workerConfig():
+    return (mode,evaluator,tuple(sorted(modelFiles.items())),batchSize,tuple(globals()[name] for name in searchSwitches))
+
+#runs once in each worker process
+def initWorker(config):
+    global mode,evaluator
+    workerMode,workerEvaluator,workerFiles,size,switches=config
+    modelFiles.update(workerFiles)
+    mode=workerMode
+    evaluator=workerEvaluator
+    setBatchSize(size)
+    globals().update(zip(searchSwitches,switches))
+    if evaluator=="network":
+        getModel()
+        torch.set_num_threads(1) #one process per core already
+
+def getPool(workers):
+    global pool,poolSize,poolConfig
+    config=workerConfig()
+    if pool!=None and (poolSize!=workers or poolConfig!=config):
+        closePool()
+    if pool==None:
+        #spawned (not forked) workers, since forking after torch has started its threads can deadlock.
+        #the calling script must therefore be safe to import (i.e. guarded by if __name__=="__main__").
+        pool=multiprocessing.get_context("spawn").Pool(workers,initWorker,(config,))
+        poolSize=workers
+        poolConfig=config
+    return pool
+
+def closePool():
+    global pool,poolSize,poolConfig
+    if pool!=None:
+        pool.terminate()
+        pool.join()
+    pool=None
+    poolSize=0
+    poolConfig=None
+
+#searches a single root move in a worker. returns (value, whether the search was stopped, nodes, principal variation)
+def searchRootMove(board,move,depth,seconds,maxNodes):
+    global nodes,deadline,nodeLimit,stopped
+    nodes=0
+    deadline=time.perf_counter()+seconds if seconds!=None else None
+    nodeLimit=maxNodes
+    stopped=False
+    table.newSearch()
+    setTableRoot(board)
+    board.make(move)
+    r=minimax(board,depth)
+    board.unmake(move)
+    ret=(r,stopped,nodes,[move]+pvTable[1])
+    deadline=None
+    nodeLimit=None
+    stopped=False
+    return ret
+
+#the iterative deepening loop of pickMove, with each iteration's root moves searched in parallel.
+#returns (best move, principal variation, value, depth completed, nodes, iterations)
+def parallelRoot(board,moves,depth,start,timeLimit,maxNodes,workers,progress):
+    p=getPool(workers)
+    best=moves[0]
+    pv=[]
+    bestValue=None
+    completed=-1
+    total=0
+    iterations=[]
+    for d in range(depth+1):
+        seconds=None
+        budget=None
+        if d>0:
+            if timeLimit:
+                seconds=start+timeLimit-time.perf_counter()
+                if seconds<=0:
+                    break
+            if maxNodes:
+                budget=(maxNodes-total)//len(moves)
+                if budget<=0:
+                    break
+        results=p.starmap(searchRootMove,[(board,move,d,seconds,budget) for move in moves],chunksize=1)
+        total+=sum(r[2] for r in results)
+        if any(r[1] for r in results):
+            break
+        i=min(range(len(moves)),key=lambda i:results[i][0])
+        best=moves[i]
+        bestValue=results[i][0]
+        pv=results[i][3]
+        completed=d
+        iterations.append((d,total,time.perf_counter()-start))
+        if progress:
+            progress(dict(depth=d,value=bestValue,pv=list(pv),nodes=total,time=time.perf_counter()-start))
+    return (best,pv,bestValue,completed,total,iterations)
+
+#returns the board after the best move found, or None if there are no legal moves.
+#Searches iteratively deeper up to the given depth. If timeLimit (seconds) or maxNodes is given, stops once
+#either runs out and returns the best move found so far; depth 0 is always searched in full.
+#workers>1 searches root moves in parallel processes (see getPool).
+#progress, if given, is called after each completed iteration with a dict like searchInfo (without iterations).
+def pickMove(board,depth,timeLimit=None,maxNodes=None,workers=1,progress=None):
+    global nodes,deadline,nodeLimit,stopped,killers,history
+    nodes=0
+    start=time.perf_counter()
+    deadline=None
+    nodeLimit=None
+    stopped=False
+    killers=[[0,0] for i in range(64)]
+    history=[[0]*4096,[0]*4096]
+    table.newSearch()
+    setTableRoot(board)
+    moves=board.legalMoves()
+    if len(moves)==0:
         return None
-    shuffle(boards)
-    values=[minimax(b,depth) for b in boards]
-    i=values.index(min(values))
-    return boards[i]
+    if useBook and getBook():
+        move=openingBook.pick(board)
+        if move!=None:
+            searchInfo.update(depth=0,value=None,pv=[move],nodes=0,time=time.perf_counter()-start,iterations=[],
+                              book=True)
+            return board.afterMove(move)
+    shuffle(moves)
+    orderMoves(board,moves,0,True)
+    if workers>1:
+        best,pv,bestValue,completed,nodes,iterations=parallelRoot(board,moves,depth,start,timeLimit,maxNodes,workers,progress)
+        searchInfo.update(depth=completed,value=bestValue,pv=pv,nodes=nodes,time=time.perf_counter()-start,
+                          iterations=iterations,book=False)
+        return board.afterMove(best)
+    best=moves[0]
+    pv=[]
+    bestValue=None
+    completed=-1
+    iterations=[]
+    for d in range(depth+1):
+        if d==1:
+            deadline=start+timeLimit if timeLimit else None
+            nodeLimit=maxNodes
+        v=sys.maxsize
+        iterBest=None
+        line=[]
+        for move in moves:
+            board.make(move)
+            r=minimax(board,d,True,-sys.maxsize,v,False,1,pv[1:] if pv and pv[0]==move else None)
+            board.unmake(move)
+            if stopped:
+                break
+            if r<v:
+                v=r
+                iterBest=move
+                line=[move]+pvTable[1]
+        if iterBest!=None:
+            #moves are searched best first, so any move found before stopping beat the previous best at this depth
+            best=iterBest
+            pv=line
+            bestValue=v
+        if stopped:
+            break
+        completed=d
+        iterations.append((d,nodes,time.perf_counter()-start))
+        if progress:
+            progress(dict(depth=d,value=bestValue,pv=list(pv),nodes=nodes,time=time.perf_counter()-start))
+        moves.remove(best)
+        moves.insert(0,best)
+    deadline=None
+    nodeLimit=None
+    stopped=False
+    searchInfo.update(depth=completed,value=bestValue,pv=pv,nodes=nodes,time=time.perf_counter()-start,
+                      iterations=iterations,book=False)
+    return board.afterMove(best)
+
+#prints the number of leaf evaluations per second (encoding included) for each batch size,
+#over n positions reached by random moves from the given board. The evaluation cache is not used.
+def benchmark(board,batchSizes=(1,4,16,64,256),n=2048):
+    global useEvalCache
+    boards=[]
+    b=board.copy()
+    while len(boards)<n:
+        moves=b.legalMoves()
+        if len(moves)==0:
+            b=board.copy()
+            continue
+        b.make(moves[randint(0,len(moves)-1)])
+        b.flip()
+        if len(boards)%2==0:
+            boards.append(b.copy())
+        else:
+            boards.append(b.copy().flip())
+    old=batchSize
+    oldCache=useEvalCache
+    useEvalCache=False
+    for size in batchSizes:
+        setBatchSize(size)
+        t=time.perf_counter()
+        if size==1:
+            for b in boards:
+                float(value(b))
+        else:
+            for c in range(0,n,size):
+                chunk=boards[c:c+size]
+                for i in range(len(chunk)):
+                    batch[i]=features(chunk[i])
+                evaluateBatch(len(chunk))
+        t=time.perf_counter()-t
+        print("batch size "+str(size)+": "+str(round(n/t))+" evals/s")
+    setBatchSize(old)
+    useEvalCache=oldCache
+
+#prints the time pickMove takes on the given board with and without the evaluation cache, and its hit rate
+def benchmarkCache(board,depth=3):
+    global useEvalCache
+    oldCache=useEvalCache
+    for use in (False,True):
+        useEvalCache=use
+        table.clear()
+        evalCache.clear()
+        t=time.perf_counter()
+        pickMove(board,depth)
+        t=time.perf_counter()-t
+        print(("with" if use else "without")+" cache: "+str(round(t,2))+"s, "+str(searchInfo["nodes"])+" nodes"+
+              (", "+repr(evalCache)+", hit rate "+str(round(evalCache.hitRate(),3)) if use else ""))
+    useEvalCache=oldCache
+
+#prints the time pickMove takes on the given board at the given depth for each number of workers
+def benchmarkWorkers(board,depth=2,counts=(1,2,4,8)):
+    base=None
+    for n in counts:
+        pickMove(board,0,workers=n) #starts the pool (and loads the model in each worker) outside the timing
+        table.clear()
+        t=time.perf_counter()
+        pickMove(board,depth,workers=n)
+        t=time.perf_counter()-t
+        if base==None:
+            base=t
+        print(str(n)+" workers: "+str(round(t,2))+"s, speedup "+str(round(base/t,2))+", value "+str(round(searchInfo["value"],4)))
+    closePool()
+
+#the outcome the tables give for the lone king to move on board (seen from the side with the pieces), as a pair that
+#is smaller for the side with the pieces the better it is: (0, plies to mate) for a win, (1, 0) for a draw. Where the
+#material has no table, a draw if the king can capture into a drawn table position, otherwise (0, None): unknown.
+def tableOutcome(board):
+    b=board.copy().flip()
+    r=tablebase.probe(b,1)
+    if r!=None:
+        return (0,r[1]) if r[0]==-1 else (1,0)
+    for move in b.legalMoves():
+        if move.captured:
+            r=tablebase.probe(b.afterMove(move).flip(),1)
+            if r!=None and r[0]==0:
+                return (1,0)
+    return (0,None)
+
+#whether the lone king can capture a piece after a move that led to board (seen from the side with the pieces)
+def leavesPiece(board):
+    return any(move.captured for move in board.copy().flip().legalMoves())
+
+#checks that the tables never make a depth 1 search pick a worse move than the network alone, on n random positions
+#of each material: with them the move must lead to as quick a mate where the tables cover the result, never to a
+#draw the network alone avoids, and never leave a piece to be taken where the network alone does not. raises an
+#AssertionError on the first position where they do, and prints the number of positions where the outcomes differ.
+def checkTables(materials=("KR","KQ","KRR","KBB","KQR"),n=40):
+    global useTablebase
+    import random
+    from perft import fromFen
+    from tournament import randomPosition
+    old=useTablebase
+    rng=random.Random(0)
+    for material in materials:
+        differ=0
+        for i in range(n):
+            fen=randomPosition(material,rng)
+            outcomes=[]
+            hanging=[]
+            for use in (False,True):
+                useTablebase=use
+                table.clear()
+                after=pickMove(fromFen(fen),1)
+                outcomes.append(tableOutcome(after))
+                hanging.append(leavesPiece(after))
+            off,on=outcomes
+            differ+=off!=on
+            worse=on[0]>off[0] or (on[0]==off[0]==0 and None not in (on[1],off[1]) and on[1]>off[1])
+            worse=worse or (on[1]==None and hanging[1] and not hanging[0])
+            assert not worse, ("the tables pick a worse move in "+fen+": "+str(on)+" against "+str(off)+
+                               (", leaving a piece to be taken" if hanging[1] and not hanging[0] else ""))
+        print(material+": "+str(n)+" positions, tables never worse, outcomes differ in "+str(differ))
+    useTablebase=old
+
+if __name__=="__main__":
+    from board import Board
+    if mode=="all pieces":
+        start=np.zeros((8,8),dtype=np.int8)
+        start[7][4]=9
+        start[0][4]=-9
+        start[7][3]=8
+        start[7][0]=start[7][7]=5
+        start[7][2]=start[7][5]=3
+    else:
+        start=np.zeros((8,8),dtype=np.int8)
+        start[7][4]=9
+        start[0][4]=-9
+        start[7][0]=start[7][7]=5
+    if len(sys.argv)>1 and sys.argv[1]=="tables":
+        checkTables()
+    elif len(sys.argv)>1 and sys.argv[1]=="workers":
+        benchmarkWorkers(Board(start))
+    elif len(sys.argv)>1 and sys.argv[1]=="cache":
+        benchmarkCache(Board(start))
+    else:
+        benchmark(Board(start))
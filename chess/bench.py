@@ -0,0 +1,149 @@
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+from board import Board
+from perft import fromFen, perft
+
+'''
+Headless benchmark suite for the move generator (board.py) and search (ai.py). Does not import pygame.
+
+    python bench.py [--perft-depth N] [--search-depth N] [--no-search] [--extensions] [--out results.json]
+
+Runs perft on a set of standard positions and checks the node counts against known values, measures
+Board.allMoves / Board.legalMoves throughput, and times ai.pickMove at depths 1 up to --search-depth (with the
+endgame tables off, since they cover the search positions and would answer them without searching).
+With --extensions, also compares the nodes and time to each depth with quiescence search, null move pruning
+and late move reductions switched on and off.
+Results are printed and, with --out, written as JSON so runs can be compared over time. Exits with
+status 1 if any perft count is wrong.
+'''
+
+#name -> (FEN, known perft node counts for depth 1, 2, ...)
+perftSuite={
+    "start":("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",[20,400,8902,197281]),
+    "kiwipete":("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",[48,2039,97862,4085603]),
+    "castling":("r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",[26,1141,27826,1274206]),
+    "en passant":("8/8/8/2k5/2pP4/8/B7/4K3 b - d3 0 3",[8,72,492,5380]),
+    "en passant pin":("3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",[18,92,1670,10138]),
+    "rook endgame":("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",[14,191,2812,43238]),
+    "promotion":("n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1",[24,496,9483,182838]),
+    "checks and pins":("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",[6,264,9467,422333]),
+    "promotion captures":("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",[44,1486,62379,2103487]),
+    "middlegame":("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",[46,2079,89890,3894594]),
+    }
+
+#endgames with the material the evaluation networks support (see ai.features)
+searchSuite={
+    "KRR vs K":"8/8/3k4/8/8/2R5/8/4K2R w - - 0 1",
+    "KQ vs K":"8/4k3/8/8/2Q5/8/8/4K3 w - - 0 1",
+    "KBB vs K":"8/8/8/3k4/8/2B5/3BK3/8 w - - 0 1",
+    }
+
+#endgames with more material than the tables in tablebase.py cover, for comparing search settings
+extensionSuite={
+    "KQRR vs K":"8/8/3k4/8/2Q5/2R5/8/4K2R w - - 0 1",
+    "KQRB vs K":"8/2k5/8/8/2B5/2R5/3QK3/8 w - - 0 1",
+    "KRRBB vs K":"6k1/8/8/3R4/8/2B5/3BK3/7R w - - 0 1",
+    }
+#(name, ai.useQuiescence, ai.useNullMove, ai.useLateMoveReductions)
+extensionSettings=[
+    ("plain",False,False,False),
+    ("quiescence",True,False,False),
+    ("quiescence+null move",True,True,False),
+    ("quiescence+reductions",True,False,True),
+    ("all",True,True,True),
+    ]
+
+def runPerft(depth):
+    ret=[]
+    for name,(fen,counts) in perftSuite.items():
+        for d in range(1,min(depth,len(counts))+1):
+            t=time.perf_counter()
+            n=perft(fromFen(fen),d)
+            t=time.perf_counter()-t
+            ret.append({"position":name,"depth":d,"nodes":n,"expected":counts[d-1],"ok":n==counts[d-1],
+                        "seconds":t,"nodesPerSecond":n/t if t>0 else None})
+            print("perft "+name+" depth "+str(d)+": "+str(n)+(" ok" if n==counts[d-1] else " WRONG, expected "+str(counts[d-1]))+
+                  " ("+str(round(n/t) if t>0 else "-")+" nodes/s)")
+    return ret
+
+#times move generation from each perft position, as board states (allMoves) and as Move objects (legalMoves)
+def runMoveGen(repeat=200):
+    ret=[]
+    for name,(fen,counts) in perftSuite.items():
+        board=fromFen(fen)
+        for api,generate in (("allMoves",board.allMoves),("legalMoves",board.legalMoves)):
+            t=time.perf_counter()
+            for i in range(repeat):
+                n=len(generate())
+            t=time.perf_counter()-t
+            ret.append({"position":name,"api":api,"moves":n,"callsPerSecond":repeat/t,"movesPerSecond":n*repeat/t})
+            print(api+" "+name+": "+str(round(repeat/t))+" calls/s, "+str(round(n*repeat/t))+" moves/s")
+    return ret
+
+def runSearch(depth):
+    import ai
+    old=ai.useTablebase
+    ai.useTablebase=False #the tables cover searchSuite, so with them the search would only be probing them
+    ret=[]
+    for name,fen in searchSuite.items():
+        for d in range(1,depth+1):
+            board=fromFen(fen)
+            ai.table.clear()
+            random.seed(0)
+            t=time.perf_counter()
+            ai.pickMove(board,d)
+            t=time.perf_counter()-t
+            info=ai.searchInfo
+            ret.append({"position":name,"depth":d,"seconds":t,"nodes":info["nodes"],"value":info["value"]})
+            print("pickMove "+name+" depth "+str(d)+": "+str(round(t,3))+"s, "+str(info["nodes"])+" nodes")
+    ai.useTablebase=old
+    return ret
+
+#times ai.pickMove to the given depth on extensionSuite with each of extensionSettings, recording the nodes and
+#time taken to complete each iteration of the iterative deepening
+def runExtensions(depth):
+    import ai
+    old=(ai.useQuiescence,ai.useNullMove,ai.useLateMoveReductions)
+    ret=[]
+    for setting,quiescence,nullMove,reductions in extensionSettings:
+        ai.useQuiescence,ai.useNullMove,ai.useLateMoveReductions=quiescence,nullMove,reductions
+        for name,fen in extensionSuite.items():
+            ai.table.clear()
+            ai.evalCache.clear()
+            random.seed(0)
+            ai.pickMove(fromFen(fen),depth)
+            info=ai.searchInfo
+            ret.append({"setting":setting,"position":name,"value":info["value"],"iterations":info["iterations"]})
+            print(setting+", "+name+": "+", ".join("depth "+str(d)+" "+str(n)+" nodes "+str(round(t,2))+"s"
+                                                  for d,n,t in info["iterations"]))
+    ai.useQuiescence,ai.useNullMove,ai.useLateMoveReductions=old
+    return ret
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Perft and search benchmarks for the chess engine.")
+    parser.add_argument("--perft-depth",type=int,default=3)
+    parser.add_argument("--search-depth",type=int,default=4)
+    parser.add_argument("--no-search",action="store_true",help="skip ai.pickMove (which needs torch)")
+    parser.add_argument("--extensions",action="store_true",help="compare quiescence, null move and late move reduction settings")
+    parser.add_argument("--out",help="file to write the results to as JSON")
+    args=parser.parse_args()
+    results={
+        "time":time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python":platform.python_version(),
+        "machine":platform.platform(),
+        "perft":runPerft(args.perft_depth),
+        "movegen":runMoveGen(),
+        }
+    if not args.no_search:
+        results["search"]=runSearch(args.search_depth)
+        if args.extensions:
+            results["extensions"]=runExtensions(args.search_depth)
+    if args.out:
+        with open(args.out,"w") as f:
+            json.dump(results,f,indent=1)
+    if not all(r["ok"] for r in results["perft"]):
+        sys.exit(1)
@@ -0,0 +1,335 @@
+'''
+Bitboard move generation backend for Board.
+
+Squares are numbered s=8*y+x, i.e. in the same order as Board.squares.flatten(), so bit s of a
+bitboard is set when square (x,y)=(s%8,s//8) holds a piece. Like Board, everything is seen from the
+side to move: positive pieces belong to the player to move and move towards y=0, negative pieces are
+the opponent's.
+
+Moves are Move objects (see below), which Board.make and Board.unmake apply in place.
+'''
+from random import Random
+
+pieceCodes=(1,2,3,5,8,9,-1,-2,-3,-5,-8,-9)
+promotions=(2,3,5,8)
+
+#move kinds
+normal=0
+double=1 #two square pawn push; sets the en passant square
+passant=2 #en passant capture
+castle=3 #end is the king's destination; the corner piece moves next to it
+
+full=(1<<64)-1
+
+#builds a table of single-step attacks for each square, given a list of (dx,dy) steps.
+def _stepTable(steps):
+    ret=[]
+    for s in range(64):
+        x,y=s%8,s//8
+        b=0
+        for dx,dy in steps:
+            if 0<=x+dx<8 and 0<=y+dy<8:
+                b|=1<<(8*(y+dy)+x+dx)
+        ret.append(b)
+    return ret
+
+#builds a table of rays for each square, going in the direction (dx,dy) up to the board edge (not including the square itself).
+def _rayTable(dx,dy):
+    ret=[]
+    for s in range(64):
+        x,y=s%8+dx,s//8+dy
+        b=0
+        while 0<=x<8 and 0<=y<8:
+            b|=1<<(8*y+x)
+            x+=dx
+            y+=dy
+        ret.append(b)
+    return ret
+
+knightTable=_stepTable([(2,1),(2,-1),(-2,1),(-2,-1),(1,2),(-1,2),(1,-2),(-1,-2)])
+kingTable=_stepTable([(1,-1),(1,0),(1,1),(0,-1),(0,1),(-1,-1),(-1,0),(-1,1)])
+#squares attacked by a pawn of the side to move standing on s.
+#also the squares an enemy pawn must stand on to attack s.
+pawnTable=_stepTable([(1,-1),(-1,-1)])
+
+#rays are split by whether their squares have higher ("up") or lower ("down") numbers than the starting square,
+#so the nearest blocker is the lowest or highest set bit respectively.
+straightUp=[_rayTable(1,0),_rayTable(0,1)]
+straightDown=[_rayTable(-1,0),_rayTable(0,-1)]
+diagonalUp=[_rayTable(1,1),_rayTable(-1,1)]
+diagonalDown=[_rayTable(-1,-1),_rayTable(1,-1)]
+
+def _slide(s,occ,up,down):
+    att=0
+    for rays in up:
+        r=rays[s]
+        b=r&occ
+        if b:
+            r^=rays[(b&-b).bit_length()-1]
+        att|=r
+    for rays in down:
+        r=rays[s]
+        b=r&occ
+        if b:
+            r^=rays[b.bit_length()-1]
+        att|=r
+    return att
+
+def rookAttacks(s,occ):
+    return _slide(s,occ,straightUp,straightDown)
+
+def bishopAttacks(s,occ):
+    return _slide(s,occ,diagonalUp,diagonalDown)
+
+#Zobrist hash keys (see Board.rehash) -- one per piece and square, castling flag (Board.moved index)
+#and en passant square, plus one toggled on every move for the side to move, and one for boards whose
+#positive pieces are black (Board.flipped).
+_keyRandom=Random(20230501)
+pieceKeys={p:[_keyRandom.getrandbits(64) for s in range(64)] for p in pieceCodes}
+movedKeys=[_keyRandom.getrandbits(64) for i in range(6)]
+passantKeys=[_keyRandom.getrandbits(64) for s in range(64)]
+sideKey=_keyRandom.getrandbits(64)
+orientKey=_keyRandom.getrandbits(64)
+#index of each Board.moved flag once the board is flipped
+flipMoved=(1,0,4,5,2,3)
+
+#betweenTable[s][t] holds the squares strictly between s and t if they share a line, 0 otherwise.
+def _betweenTable():
+    ret=[[0]*64 for s in range(64)]
+    for rays in straightUp+straightDown+diagonalUp+diagonalDown:
+        for s in range(64):
+            r=rays[s]
+            while r:
+                low=r&-r
+                t=low.bit_length()-1
+                ret[s][t]=rays[s]^rays[t]^low
+                r^=low
+    return ret
+
+betweenTable=_betweenTable()
+
+#yields the square numbers of all set bits, lowest first.
+def squaresOf(b):
+    while b:
+        low=b&-b
+        yield low.bit_length()-1
+        b^=low
+
+'''
+A single move, as generated for the side to move.
+
+Variables:
+int start, end:
+    square numbers the piece moves from and to (for castling, end is the king's destination)
+int promotion:
+    the piece a pawn promotes to, 0 if the move is not a promotion
+int kind:
+    normal, double, passant or castle (see above)
+int captured:
+    the piece on the captured square before the move, 0 if nothing is captured
+'''
+class Move:
+    __slots__=("start","end","promotion","kind","captured")
+
+    def __init__(self,start,end,promotion=0,kind=normal,captured=0):
+        self.start=start
+        self.end=end
+        self.promotion=promotion
+        self.kind=kind
+        self.captured=captured
+
+    def __eq__(self,other):
+        return isinstance(other,Move) and self.start==other.start and self.end==other.end and self.promotion==other.promotion
+
+    #packs the move into a 16 bit integer (enough to find it again among the legal moves of its position)
+    def pack(self):
+        return self.start|(self.end<<6)|(self.promotion<<12)
+
+    def __hash__(self):
+        return self.pack()
+
+    def __repr__(self):
+        return "Move("+str(toIndex(self.start))+","+str(toIndex(self.end))+(","+str(self.promotion) if self.promotion else "")+")"
+
+def toSquare(index):
+    if index==(-1,-1):
+        return -1
+    return 8*index[1]+index[0]
+
+def toIndex(s):
+    return (s&7,s>>3)
+
+#the name of square s (e.g. "e4"), for a board seen from white if white, otherwise from black
+def squareName(s,white):
+    x,y=toIndex(s)
+    return chr(ord("a")+x)+str(8-y if white else y+1)
+
+class Bits:
+    def __init__(self,squares):
+        box=squares.ravel().tolist()
+        bb=dict.fromkeys(pieceCodes,0)
+        own=0
+        enemy=0
+        for s in range(64):
+            v=box[s]
+            if v:
+                bb[v]|=1<<s
+                if v>0:
+                    own|=1<<s
+                else:
+                    enemy|=1<<s
+        self.box=box #piece on each square, in the same order as the bits
+        self.bb=bb
+        self.own=own
+        self.enemy=enemy
+        self.occ=own|enemy
+
+    def kingSquare(self):
+        k=self.bb[9]
+        if k==0:
+            return -1
+        return (k&-k).bit_length()-1
+
+    #returns a bitboard of the opponent's pieces attacking square s, given the occupancy occ
+    def attackers(self,s,occ=None):
+        bb=self.bb
+        if occ==None:
+            occ=self.occ
+        return ((knightTable[s]&bb[-2])|(pawnTable[s]&bb[-1])|(kingTable[s]&bb[-9])
+                |(rookAttacks(s,occ)&(bb[-5]|bb[-8]))|(bishopAttacks(s,occ)&(bb[-3]|bb[-8])))
+
+    #returns true if square s is attacked by the opponent, given the occupancy occ
+    def attacked(self,s,occ=None):
+        bb=self.bb
+        if occ==None:
+            occ=self.occ
+        if knightTable[s]&bb[-2] or pawnTable[s]&bb[-1] or kingTable[s]&bb[-9]:
+            return True
+        if rookAttacks(s,occ)&(bb[-5]|bb[-8]):
+            return True
+        if bishopAttacks(s,occ)&(bb[-3]|bb[-8]):
+            return True
+        return False
+
+    def inCheck(self):
+        k=self.kingSquare()
+        if k==-1:
+            return False
+        return self.attacked(k)
+
+    #returns true if making the given (non-castling) move leaves the own king safe
+    def isLegal(self,move):
+        start=move.start
+        end=move.end
+        bb=self.bb
+        box=self.box
+        capSq=end
+        if move.kind==passant:
+            capSq=end+8
+        captured=move.captured
+        occ=(self.occ^(1<<start)^(1<<capSq if captured else 0))|(1<<end)
+        k=end if box[start]==9 else self.kingSquare()
+        if k==-1:
+            return True
+        if captured<0:
+            bb[captured]^=1<<capSq
+            ret=not self.attacked(k,occ)
+            bb[captured]^=1<<capSq
+            return ret
+        return not self.attacked(k,occ)
+
+    #returns true if the king on s may castle towards the corner square, crossing the square passing
+    #and landing on land. The king may not be in check, pass through check or land in check.
+    def _canCastle(self,s,corner,passing,land):
+        if self.attacked(s):
+            return False
+        occ=self.occ^(1<<s)
+        if self.attacked(passing,occ|(1<<passing)):
+            return False
+        occ|=1<<land
+        bb=self.bb
+        p=self.box[corner]
+        if p:
+            occ^=(1<<corner)|(1<<passing)
+        if p<0:
+            bb[p]^=(1<<corner)|(1<<passing)
+            ret=not self.attacked(land,occ)
+            bb[p]^=(1<<corner)|(1<<passing)
+            return ret
+        return not self.attacked(land,occ)
+
+    #returns all legal moves of the side to move, optionally only from square frm, and (captures) only captures and promotions.
+    #Checks and pins on the own king are worked out once, so moves only need testing against the resulting masks.
+    def legalMoves(self,moved,enPassant=(-1,-1),frm=None,captures=False):
+        ret=[]
+        box=self.box
+        bb=self.bb
+        own=self.own
+        occ=self.occ
+        free=full^own
+        landing=self.enemy if captures else full #squares pieces other than pawns may move to
+        ep=toSquare(enPassant)
+        mask=full if frm==None else 1<<frm
+        k=self.kingSquare()
+        target=free #squares pieces other than the king may move to
+        checkers=0
+        pins={} #pinned piece square -> squares it may move to without leaving the pin line
+        if k!=-1:
+            checkers=self.attackers(k)
+            if checkers&(checkers-1):
+                target=0
+            elif checkers:
+                target=checkers|betweenTable[k][checkers.bit_length()-1]
+            enemy=self.enemy
+            snipers=(rookAttacks(k,enemy)&(bb[-5]|bb[-8]))|(bishopAttacks(k,enemy)&(bb[-3]|bb[-8]))
+            for s in squaresOf(snipers):
+                b=betweenTable[k][s]&occ
+                if b and not b&(b-1) and b&own:
+                    pins[b.bit_length()-1]=betweenTable[k][s]|(1<<s)
+        for s in squaresOf(bb[1]&mask):
+            allow=target&pins[s] if s in pins else target
+            x=s&7
+            y=s>>3
+            t=s-8
+            if box[t]==0 and (y==1 or not captures):
+                if allow&(1<<t):
+                    if y==1:
+                        ret+=[Move(s,t,q) for q in promotions]
+                    else:
+                        ret.append(Move(s,t))
+                if y==6 and not captures and box[s-16]==0 and allow&(1<<(s-16)):
+                    ret.append(Move(s,s-16,0,double))
+            for dx in (1,-1):
+                if 0<=x+dx<8:
+                    t=s-8+dx
+                    p=box[t]
+                    if t==ep:
+                        #en passant removes two pieces from the capturing rank, so is checked in full
+                        move=Move(s,t,0,passant,box[t+8])
+                        if self.isLegal(move):
+                            ret.append(move)
+                    elif p<0 and allow&(1<<t):
+                        if y==1:
+                            ret+=[Move(s,t,q,normal,p) for q in promotions]
+                        else:
+                            ret.append(Move(s,t,0,normal,p))
+        if target:
+            for s in squaresOf(bb[2]&mask):
+                if s not in pins:
+                    ret+=[Move(s,t,0,normal,box[t]) for t in squaresOf(knightTable[s]&target&landing)]
+            for s in squaresOf((bb[3]|bb[8])&mask):
+                allow=(target&pins[s] if s in pins else target)&landing
+                ret+=[Move(s,t,0,normal,box[t]) for t in squaresOf(bishopAttacks(s,occ)&allow)]
+            for s in squaresOf((bb[5]|bb[8])&mask):
+                allow=(target&pins[s] if s in pins else target)&landing
+                ret+=[Move(s,t,0,normal,box[t]) for t in squaresOf(rookAttacks(s,occ)&allow)]
+        for s in squaresOf(bb[9]&mask):
+            kingless=occ^(1<<s) #so sliders attack through the king's current square
+            ret+=[Move(s,t,0,normal,box[t]) for t in squaresOf(kingTable[s]&free&landing) if not self.attacked(t,kingless)]
+            #castling -- squares between king and corner must be empty
+            if not moved[0] and not checkers and not captures:
+                if not moved[2] and not occ&((1<<57)|(1<<58)|(1<<59)) and self._canCastle(s,56,59,58):
+                    ret.append(Move(s,58,0,castle))
+                if not moved[3] and not occ&((1<<61)|(1<<62)) and self._canCastle(s,63,61,62):
+                    ret.append(Move(s,62,0,castle))
+        return ret
@@ -2,6 +2,7 @@ from math import floor
 from random import shuffle
 import numpy as np
 from random import randint
+from bitboard import Bits, Move, toSquare, toIndex, double, passant, castle, pieceKeys, movedKeys, passantKeys, sideKey, orientKey, flipMoved
 
 '''
 Todo:
@@ -11,6 +12,8 @@ Todo:
 '''
 
 class Board:
+    backend="bitboard" #move generator to use -- "bitboard" or "array" (the original numpy line scanning)
+
     def __init__(self,array=None,moved=None):
         if array.__class__.__name__=='NoneType':
             array=np.array([[-5,-2,-3,-8,-9,-3,-2,-5],
@@ -42,6 +45,7 @@ class Board:
         self.whiteKingPos=(4,7)
         self.blackKingPos=(4,0)
         self.enPassant=(-1,-1)
+        self.history=[] #state needed to unmake each move made with make
         self.updateKingPos()
         if moved==None:
             moved=[False,False,False,False,False,False]
@@ -56,6 +60,13 @@ class Board:
             if self.blackKingPos!=(4,0):
                 moved[1]=True
         self.moved=moved
+        self.turn=0 #flips on every move made; used for the side to move in the hash
+        #true when the positive pieces are black (flipped an odd number of times). Part of the hash, since the search
+        #sees the board from the root player and the table is shared by both sides: with it, the same array and turn
+        #in white's search and in black's are different positions, with different sides to move.
+        self.flipped=False
+        self.targets=None #(hash, targets) cached by moveTargets
+        self.rehash()
 
     '''def populate(self):
         array=np.array([[ 0, 0, 0, 0, 0, 0, 0, 0],
@@ -98,10 +109,24 @@ class Board:
         self.squares=array'''
             
     def copy(self):
-        b=Board(np.copy(self.squares),list(self.moved))
+        #skips the constructor, which would rescan the board for kings
+        b=Board.__new__(Board)
+        b.squares=np.copy(self.squares)
+        b.moved=list(self.moved)
         b.whiteKingPos=self.whiteKingPos
         b.blackKingPos=self.blackKingPos
         #self.enPassant should be cleared on copy.
+        b.enPassant=(-1,-1)
+        b.history=[]
+        b.turn=self.turn
+        b.flipped=self.flipped
+        b.hash=self.hash
+        b.flipHash=self.flipHash
+        b.targets=None
+        if self.enPassant!=(-1,-1):
+            s=toSquare(self.enPassant)
+            b.hash^=passantKeys[s]
+            b.flipHash^=passantKeys[s^56]
         return b
 
     def __str__(self):
@@ -115,9 +140,7 @@ class Board:
         return str(self)
 
     def flip(self):
-        self.squares=-self.squares
-        for i in range(4):
-            self.squares[[i,7-i],:]=self.squares[[7-i,i],:]
+        self.squares=-self.squares[::-1]
         self.moved=[self.moved[1],self.moved[0],self.moved[4],self.moved[5],self.moved[2],self.moved[3]]
         x,y=self.whiteKingPos
         a,b=self.blackKingPos
@@ -127,8 +150,37 @@ class Board:
         self.whiteKingPos=(a,b)
         if self.enPassant!=(-1,-1):
             self.enPassant=(self.enPassant[0],7-self.enPassant[1])
+        self.hash,self.flipHash=self.flipHash,self.hash
+        self.flipped=not self.flipped
         return self
 
+    #returns the Zobrist hash of the board as it is, and as it would be flipped.
+    #Covers the pieces, moved flags, en passant square, side to move (via turn) and which colour is positive (flipped).
+    def computeHash(self):
+        h=f=sideKey if self.turn else 0
+        if self.flipped:
+            h^=orientKey
+        else:
+            f^=orientKey
+        for s,p in enumerate(self.squares.ravel().tolist()):
+            if p:
+                h^=pieceKeys[p][s]
+                f^=pieceKeys[-p][s^56]
+        for i in range(6):
+            if self.moved[i]:
+                h^=movedKeys[i]
+                f^=movedKeys[flipMoved[i]]
+        if self.enPassant!=(-1,-1):
+            s=toSquare(self.enPassant)
+            h^=passantKeys[s]
+            f^=passantKeys[s^56]
+        return (h,f)
+
+    #recomputes the hash from scratch -- needed after changing squares, moved or enPassant other than through make/unmake.
+    #make, unmake, copy and flip keep it up to date incrementally.
+    def rehash(self):
+        self.hash,self.flipHash=self.computeHash()
+
     def __getitem__(self,key):
         return self.squares[:,key]
 
@@ -180,6 +232,7 @@ class Board:
             ]
         return [i for i in ret if (i[0] in range(8) and i[1] in range(8))]
 
+    #moves a piece without any of make's bookkeeping -- the hash is left stale until rehash is called.
     def move(self,start,end):
         a,b=start
         x,y=end
@@ -193,10 +246,21 @@ class Board:
                     self.moved[2]=True
                 elif start==(7,7):
                     self.moved[3]=True
+        #landing on an enemy rook's starting square means that rook has been captured (or already gone)
+        if end==(0,0):
+            self.moved[4]=True
+        elif end==(7,0):
+            self.moved[5]=True
         self[a][b]=0
         self[x][y]=piece
 
+    #returns false if the side to move is in check, true otherwise
     def isValid(self):
+        if Board.backend=="array":
+            return self.isValidArray()
+        return not Bits(self.squares).inCheck()
+
+    def isValidArray(self):
         #given a line and index as an input (i.e. the output of self.line function),
         #returns false if an attack can be made at the king from that line, true otherwise
         #pieces should be a list of which pieces in the line should be considered for potential attacks
@@ -248,21 +312,153 @@ class Board:
 
     #makes sure the listed king positions are accurate.
     def updateKingPos(self):
-        for i in range(8):
-            for j in range(8):
-                v=self.getSqr((i,j))
-                if v==9:
-                    self.whiteKingPos=(i,j)
-                elif v==-9:
-                    self.blackKingPos=(i,j)
+        y,x=np.nonzero(self.squares==9)
+        if len(x):
+            self.whiteKingPos=(int(x[-1]),int(y[-1]))
+        y,x=np.nonzero(self.squares==-9)
+        if len(x):
+            self.blackKingPos=(int(x[-1]),int(y[-1]))
 
     def moveAndCopy(self,start,end):
         b=self.copy()
         b.move(start,end)
         return b
 
+    #makes the given move (a Move object from legalMoves) in place. unmake reverses it.
+    def make(self,move):
+        moved=self.moved
+        self.history.append((moved,self.enPassant,self.whiteKingPos,self.hash,self.flipHash))
+        h=self.hash^sideKey
+        f=self.flipHash^sideKey
+        self.turn^=1
+        if self.enPassant!=(-1,-1):
+            s=toSquare(self.enPassant)
+            h^=passantKeys[s]
+            f^=passantKeys[s^56]
+            self.enPassant=(-1,-1)
+        squares=self.squares
+        start=move.start
+        a,b=start&7,start>>3
+        end=move.end
+        x,y=end&7,end>>3
+        piece=int(squares[b,a])
+        placed=move.promotion or piece
+        squares[b,a]=0
+        squares[y,x]=placed
+        h^=pieceKeys[piece][start]^pieceKeys[placed][end]
+        f^=pieceKeys[-piece][start^56]^pieceKeys[-placed][end^56]
+        kind=move.kind
+        captured=move.captured
+        if captured:
+            s=end+8 if kind==passant else end
+            h^=pieceKeys[captured][s]
+            f^=pieceKeys[-captured][s^56]
+        if piece==9:
+            moved=list(moved)
+            moved[0]=True
+            self.whiteKingPos=(x,y)
+        elif piece==5 and (start==56 or start==63) and not moved[2+(start==63)]:
+            moved=list(moved)
+            moved[2+(start==63)]=True
+        if (end==0 or end==7) and not moved[4+(end==7)]:
+            #the enemy rook on this corner has been captured (or already gone)
+            moved=list(moved)
+            moved[4+(end==7)]=True
+        if kind==double:
+            self.enPassant=(x,y+1)
+            s=end+8
+            h^=passantKeys[s]
+            f^=passantKeys[s^56]
+        elif kind==passant:
+            squares[b,x]=0
+        elif kind==castle:
+            corner,rook=(56,59) if x==2 else (63,61)
+            p=int(squares[7,corner&7])
+            if p:
+                squares[7,corner&7]=0
+                squares[7,rook&7]=p
+                h^=pieceKeys[p][corner]^pieceKeys[p][rook]
+                f^=pieceKeys[-p][corner^56]^pieceKeys[-p][rook^56]
+            if p==5:
+                moved[2+(corner==63)]=True
+        if moved is not self.moved:
+            for i in range(6):
+                if moved[i]!=self.moved[i]:
+                    h^=movedKeys[i]
+                    f^=movedKeys[flipMoved[i]]
+            self.moved=moved
+        self.hash=h
+        self.flipHash=f
+
+    #reverses the last move made with make -- move should be the same Move object.
+    def unmake(self,move):
+        self.moved,self.enPassant,self.whiteKingPos,self.hash,self.flipHash=self.history.pop()
+        self.turn^=1
+        squares=self.squares
+        start=move.start
+        a,b=start&7,start>>3
+        end=move.end
+        x,y=end&7,end>>3
+        squares[b,a]=1 if move.promotion else squares[y,x]
+        kind=move.kind
+        if kind==passant:
+            squares[y,x]=0
+            squares[b,x]=move.captured
+        else:
+            squares[y,x]=move.captured
+        if kind==castle:
+            corner,rook=(0,3) if x==2 else (7,5)
+            squares[7,corner]=squares[7,rook]
+            squares[7,rook]=0
+
+    #passes the turn without moving (for null move pruning in ai.minimax). unmakeNull reverses it.
+    def makeNull(self):
+        self.history.append((self.moved,self.enPassant,self.whiteKingPos,self.hash,self.flipHash))
+        self.turn^=1
+        self.hash^=sideKey
+        self.flipHash^=sideKey
+        if self.enPassant!=(-1,-1):
+            s=toSquare(self.enPassant)
+            self.hash^=passantKeys[s]
+            self.flipHash^=passantKeys[s^56]
+            self.enPassant=(-1,-1)
+
+    def unmakeNull(self):
+        self.moved,self.enPassant,self.whiteKingPos,self.hash,self.flipHash=self.history.pop()
+        self.turn^=1
+
+    #returns a list of all legal moves, as Move objects, optionally only those of the piece at the given index.
+    def legalMoves(self,index=None):
+        if index==None:
+            return Bits(self.squares).legalMoves(self.moved,self.enPassant)
+        return Bits(self.squares).legalMoves(self.moved,self.enPassant,toSquare(index))
+
+    #returns where the piece at the given index can move, as a dict from each destination (x,y) to the list of
+    #Move objects going there (one per promotion piece for promotions, otherwise one). Move.kind and Move.captured
+    #tell castling, en passant and captures apart. The moves of every piece are worked out together, once per
+    #position, and kept until the board changes, so the GUI can highlight a selected piece without making boards.
+    def moveTargets(self,index):
+        if self.targets==None or self.targets[0]!=self.hash:
+            targets={}
+            for move in self.legalMoves():
+                targets.setdefault(toIndex(move.start),{}).setdefault(toIndex(move.end),[]).append(move)
+            self.targets=(self.hash,targets)
+        return self.targets[1].get(index,{})
+
+    #returns the board state after the given move is made, leaving this board unchanged
+    def afterMove(self,move):
+        board=self.copy()
+        board.make(move)
+        board.history=[]
+        return board
+
     #returns a list of all possible moves the piece at the given index can make, as board states (i.e. board objects).
     def movesFrom(self,index):
+        if Board.backend=="array":
+            return self.movesFromArray(index)
+        return [self.afterMove(move) for move in self.legalMoves(index)]
+
+    def movesFromArray(self,index):
         #given a line and index as an input (i.e. the output of self.line function),
         #returns the number of indices the piece can move in both directions as an ordered pair: (-x,y) which indicates the piece
         #can move up to x units down the list and y units up the list (both x and y should be nonnegative)
@@ -367,7 +563,7 @@ class Board:
             moves=[i for i in moves if self.getSqr(i)<=0]
             ret+=[self.moveAndCopy(index,move) for move in moves]
             #Check for possible castling
-            if (not self.moved[0]) and (not self.moved[2]) and self.isValid():
+            if (not self.moved[0]) and (not self.moved[2]) and self.isValidArray():
                 castle=True
                 for i in range(3):
                     if self.getSqr((i+1,7))!=0:
@@ -375,11 +571,11 @@ class Board:
                         break
                 if castle:
                     board=self.moveAndCopy(index,(3,7))
-                    if board.isValid():
+                    if board.isValidArray():
                         board.move((3,7),(2,7))
                         board.move((0,7),(3,7))
                         ret.append(board)
-            if (not self.moved[0]) and (not self.moved[3]) and self.isValid():
+            if (not self.moved[0]) and (not self.moved[3]) and self.isValidArray():
                 castle=True
                 for i in range(2):
                     if self.getSqr((7-i-1,7))!=0:
@@ -387,17 +583,28 @@ class Board:
                         break
                 if castle:
                     board=self.moveAndCopy(index,(5,7))
-                    if board.isValid():
+                    if board.isValidArray():
                         board.move((5,7),(6,7))
                         board.move((7,7),(5,7))
                         ret.append(board)
             for board in ret:
                 board.updateKingPos()
-        return [board for board in ret if board.isValid()]
+        ret=[board for board in ret if board.isValidArray()]
+        for board in ret:
+            board.turn=self.turn^1
+            board.rehash()
+        return ret
+
+    #returns a list of all possible moves, as board states, or as Move objects if asMoves is true
+    def allMoves(self,asMoves=False):
+        if asMoves:
+            return self.legalMoves()
+        if Board.backend=="array":
+            return self.allMovesArray()
+        return [self.afterMove(move) for move in self.legalMoves()]
 
-    #returns a list of all possible moves
-    def allMoves(self):
-        moves=[self.movesFrom((i,j)) for i in range(8) for j in range(8)]
+    def allMovesArray(self):
+        moves=[self.movesFromArray((i,j)) for i in range(8) for j in range(8)]
         moves=[x for move in moves for x in move]
         '''
         for i in range(8):
@@ -0,0 +1,253 @@
+import os
+import re
+import time
+import heapq
+import bisect
+import random
+import argparse
+import tempfile
+import numpy as np
+from board import Board
+from bitboard import castle, squareName, sideKey, orientKey, movedKeys
+from perft import fromFen
+
+'''
+Opening book for ai.pickMove.
+
+    python book.py CORPUS [CORPUS ...] [--out book.bin] [--plies N] [--max-entries N]
+
+compiles games into a book: a binary file of (position key, move, weight) records sorted by key and move, where the
+weight is the number of games that played the move in the position. Files ending in .pgn are read as PGN (headers,
+comments, variations and annotations are skipped; a FEN header sets the starting position); other files hold one game
+per line as a list of moves, in SAN ("e4 e5 Nf3") or coordinates ("e2e4 e7e5 g1f3"), optionally with move numbers.
+Only the first --plies half moves of each game are used.
+
+The input is read a game at a time. Moves are counted in memory until --max-entries different (position, move) pairs
+have been seen, then written out as a sorted run; the runs are merged into the book at the end, so the memory used
+does not grow with the size of the corpus.
+
+Book looks positions up by binary search over the memory mapped file, so opening it reads nothing and a lookup only
+touches the few pages the search visits.
+'''
+
+recordType=np.dtype([("key","<u8"),("move","<u2"),("weight","<u4")]) #packed, 14 bytes per record
+pieceLetters={"N":2,"B":3,"R":5,"Q":8,"K":9}
+coordinates=re.compile("^[a-h][1-8][a-h][1-8][qrbn]?$")
+
+#the key of a position in the book: its hash without the side to move or the colour of the positive pieces, and with
+#the castling flags reduced to the castling rights they leave (a moved king makes its rooks' flags irrelevant, for
+#instance). Board is seen from the side to move, so the same position reached with either colour to move is the same
+#(mirrored) position.
+def positionKey(board):
+    m=board.moved
+    rights=[m[0] or (m[2] and m[3]),m[1] or (m[4] and m[5]),m[0] or m[2],m[0] or m[3],m[1] or m[4],m[1] or m[5]]
+    key=board.hash^sideKey if board.turn else board.hash
+    if board.flipped:
+        key^=orientKey
+    for i in range(6):
+        if m[i]!=rights[i]:
+            key^=movedKeys[i]
+    return key
+
+#returns the legal move the token (SAN or coordinates) stands for, board being seen from the side to move and
+#white telling whether that is white. Raises an Exception if there is no such move, or more than one.
+def parseMove(board,token,white):
+    moves=board.legalMoves()
+    flat=board.squares.ravel()
+    if coordinates.match(token):
+        promotion=pieceLetters[token[4].upper()] if len(token)==5 else 0
+        found=[m for m in moves if squareName(m.start,white)==token[:2] and squareName(m.end,white)==token[2:4] and
+               m.promotion==promotion]
+    else:
+        san=token.rstrip("+#!?").replace("0","O")
+        if san in ("O-O","O-O-O"):
+            found=[m for m in moves if m.kind==castle and (m.end&7==6)==(san=="O-O")]
+        else:
+            promotion=0
+            if "=" in san:
+                san,p=san.split("=")
+                promotion=pieceLetters[p]
+            elif san[-1] in "NBRQ" and san[-2].isdigit():
+                promotion=pieceLetters[san[-1]]
+                san=san[:-1]
+            piece=1
+            if san[0] in pieceLetters:
+                piece=pieceLetters[san[0]]
+                san=san[1:]
+            target=san[-2:]
+            hint=san[:-2].replace("x","") #file and/or rank of the starting square, if given
+            found=[m for m in moves if flat[m.start]==piece and squareName(m.end,white)==target and
+                   m.promotion==promotion and all(c in squareName(m.start,white) for c in hint)]
+    if len(found)!=1:
+        raise Exception("Cannot play "+token+" ("+str(len(found))+" matching moves)")
+    return found[0]
+
+#yields (FEN or None, move tokens) for each game in a PGN file, reading it a line at a time
+def readPgn(path):
+    fen=None
+    tokens=[]
+    depth=0 #nesting of comments and variations being skipped
+    with open(path,errors="replace") as f:
+        for line in f:
+            line=line.strip()
+            if depth==0 and line.startswith("["):
+                if tokens:
+                    yield fen,tokens
+                    fen=None
+                    tokens=[]
+                if line.startswith("[FEN "):
+                    fen=line[6:line.rindex('"')]
+                continue
+            if depth==0 and line.startswith("%"):
+                continue
+            for token in re.findall(r"\{|\}|\(|\)|;.*|[^\s{}();]+",line):
+                if token in ("{","("):
+                    depth+=1
+                elif token in ("}",")"):
+                    depth-=1
+                elif depth==0 and not token.startswith(";"):
+                    if token in ("1-0","0-1","1/2-1/2","*"):
+                        if tokens:
+                            yield fen,tokens
+                        fen=None
+                        tokens=[]
+                    else:
+                        tokens.append(token)
+    if tokens:
+        yield fen,tokens
+
+#yields (None, move tokens) for each line of a file of move lists
+def readMoveLists(path):
+    with open(path,errors="replace") as f:
+        for line in f:
+            tokens=line.split()
+            if tokens:
+                yield None,tokens
+
+#yields (position key, packed move) for the first plies half moves of a game, stopping at the first move that
+#cannot be played.
+def replay(fen,tokens,plies):
+    board=fromFen(fen) if fen else Board()
+    white=not fen or len(fen.split())<2 or fen.split()[1]!="b"
+    n=0
+    for token in tokens:
+        token=re.sub(r"^\d+\.+","",token) #move numbers, also when written together with the move ("1.e4")
+        if token=="" or token.startswith("$"):
+            continue
+        if n>=plies:
+            return
+        move=parseMove(board,token,white)
+        yield positionKey(board),move.pack()
+        board.make(move)
+        board.flip()
+        white=not white
+        n+=1
+
+#writes the counted moves as a run file sorted by key and move
+def writeRun(counts,path):
+    run=np.zeros(len(counts),dtype=recordType)
+    run["key"]=np.fromiter((k for k,m in counts),dtype=np.uint64,count=len(counts))
+    run["move"]=np.fromiter((m for k,m in counts),dtype=np.uint16,count=len(counts))
+    run["weight"]=np.fromiter(counts.values(),dtype=np.uint32,count=len(counts))
+    run.sort(order=["key","move"])
+    np.save(path,run)
+
+#yields the (key, move, weight) records of a run file, a block at a time
+def readRun(path,block=1<<16):
+    run=np.load(path,mmap_mode="r")
+    for i in range(0,len(run),block):
+        yield from run[i:i+block].tolist()
+
+#merges sorted runs into the book file at out, adding up the weights of records for the same position and move.
+#returns the number of records written.
+def merge(runs,out,block=1<<16):
+    buffer=[]
+    n=0
+    last=None
+    with open(out,"wb") as f:
+        for key,move,weight in heapq.merge(*[readRun(path) for path in runs]):
+            if last!=None and last[0]==key and last[1]==move:
+                last[2]+=weight
+                continue
+            if last!=None:
+                buffer.append(tuple(last))
+            last=[key,move,weight]
+            if len(buffer)>=block:
+                np.array(buffer,dtype=recordType).tofile(f)
+                n+=len(buffer)
+                buffer=[]
+        if last!=None:
+            buffer.append(tuple(last))
+        np.array(buffer,dtype=recordType).tofile(f)
+        n+=len(buffer)
+    return n
+
+#compiles the games in the given files into a book at out. returns (games read, games with an unplayable move,
+#records written).
+def build(paths,out,plies=24,maxEntries=1<<19):
+    games=0
+    bad=0
+    counts={}
+    with tempfile.TemporaryDirectory() as directory:
+        runs=[]
+        for path in paths:
+            reader=readPgn if path.lower().endswith(".pgn") else readMoveLists
+            for fen,tokens in reader(path):
+                games+=1
+                try:
+                    for entry in replay(fen,tokens,plies):
+                        counts[entry]=counts.get(entry,0)+1
+                except Exception:
+                    bad+=1 #the moves before the bad one are kept
+                if len(counts)>=maxEntries:
+                    runs.append(os.path.join(directory,"run"+str(len(runs))+".npy"))
+                    writeRun(counts,runs[-1])
+                    counts={}
+        if counts or not runs:
+            runs.append(os.path.join(directory,"run"+str(len(runs))+".npy"))
+            writeRun(counts,runs[-1])
+        records=merge(runs,out)
+    return games,bad,records
+
+class Book:
+    def __init__(self,path):
+        self.records=np.memmap(path,dtype=recordType,mode="r") if os.path.getsize(path) else np.zeros(0,dtype=recordType)
+        self.keys=self.records["key"] #a strided view; bisect indexes it without copying the file
+
+    def __len__(self):
+        return len(self.records)
+
+    #returns a list of (Move, weight) for the book moves of the position, board being seen from the side to move
+    def probe(self,board):
+        key=positionKey(board)
+        lo=bisect.bisect_left(self.keys,key)
+        hi=lo
+        while hi<len(self.keys) and self.keys[hi]==key:
+            hi+=1
+        if lo==hi:
+            return []
+        moves={m.pack():m for m in board.legalMoves()}
+        entries=self.records[lo:hi].tolist()
+        return [(moves[move],weight) for key,move,weight in entries if move in moves]
+
+    #returns a book move for the position, chosen at random in proportion to the weights, or None
+    def pick(self,board,rng=random):
+        entries=self.probe(board)
+        if not entries:
+            return None
+        return rng.choices([m for m,w in entries],[w for m,w in entries])[0]
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Compile an opening book for ai.pickMove.")
+    parser.add_argument("corpus",nargs="+",help=".pgn files or files of move lists, one game per line")
+    parser.add_argument("--out",default="book.bin")
+    parser.add_argument("--plies",type=int,default=24,help="half moves of each game to use")
+    parser.add_argument("--max-entries",type=int,default=1<<19,help="moves counted in memory before writing a run")
+    args=parser.parse_args()
+    t=time.perf_counter()
+    games,bad,records=build(args.corpus,args.out,args.plies,args.max_entries)
+    print(str(games)+" games ("+str(bad)+" with an unplayable move), "+str(records)+" records in "+
+          str(round(time.perf_counter()-t,1))+"s")
+    book=Book(args.out)
+    print("start position: "+", ".join(squareName(m.start,True)+squareName(m.end,True)+" "+str(w)
+                                      for m,w in sorted(book.probe(Board()),key=lambda e:-e[1])))
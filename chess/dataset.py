@@ -0,0 +1,224 @@
+import os
+import glob
+import time
+import random
+import argparse
+import numpy as np
+from bitboard import pieceCodes
+from perft import fromFen
+from tournament import Player, randomPosition
+import tablebase
+import ai
+
+'''
+Training data for the evaluation networks.
+
+The encoders take a stack of positions, an (N,8,8) int8 array of Board.squares arrays, and work on all of them at once:
+    orient(positions)                -> the positions seen from the side with the pieces, and the sign to give values
+    coordinates(positions,mode)      -> (N,features) float32, the coordinate features ai.features gives each position
+    planes(positions)                -> (N,12,8,8) float32, one 0/1 plane per piece code in bitboard.pieceCodes order
+
+    python dataset.py OUT [--material KRR] [--games N] [--player minimax2@material] [--shard-size N] [--seed N]
+
+plays games from random positions with the given material against a lone king and writes the positions into OUT as
+shards: .npy files of at most --shard-size records, each a position (seen from the side with the pieces, which is to
+move), its features for the current mode and its value, the number of moves to mate as the networks are trained to
+predict. Wherever the endgame tables (see tablebase.py) cover a position, both sides play the move the tables say is
+best and the value comes from the tables, so such games always end in mate; elsewhere --player picks the moves and
+the value comes from the mate the game ended in, positions of games that end otherwise being left out. Games are
+played and written one at a time, so memory is bounded by the shard size. readShards memory maps them back.
+
+    python dataset.py --verify
+
+checks the encoders against ai.evalFeatures on random positions and times both.
+'''
+
+codes=np.array(pieceCodes,dtype=np.int8)
+
+#returns the positions seen from the side with the pieces, and the sign (1 or -1) to give what a network says about
+#them, like ai.evalFeatures: a position whose own side has nothing but its king is flipped.
+def orient(positions):
+    own=(positions>0).sum(axis=(1,2))
+    enemy=(positions<0).sum(axis=(1,2))
+    flip=(own==1)&(enemy>1)
+    return np.where(flip[:,None,None],-positions[:,::-1],positions),np.where(flip,-1.0,1.0).astype(np.float32)
+
+#returns the (x,y) coordinates, counted from 1, of the first count pieces with the given code in each of n positions,
+#in the order ai.features finds them, as an (n,count,2) array with (0,0) for missing pieces; and the number of such
+#pieces in each position. rows, squares and values describe the occupied squares of the positions, ordered by
+#position and then column by column (see coordinates).
+def find(rows,squares,values,n,code,count):
+    sel=values==code
+    r=rows[sel]
+    s=squares[sel]
+    index=np.arange(len(r))
+    first=np.ones(len(r),dtype=bool)
+    first[1:]=r[1:]!=r[:-1]
+    rank=index-np.maximum.accumulate(np.where(first,index,0)) #0 for a position's first piece, 1 for its second...
+    keep=rank<count
+    ret=np.zeros((n,count,2),dtype=np.float32)
+    ret[r[keep],rank[keep],0]=(s[keep]>>3)+1
+    ret[r[keep],rank[keep],1]=(s[keep]&7)+1
+    return ret,np.bincount(r,minlength=n)
+
+#returns the features of each position for the networks of the given mode (see ai.features), as an (N,features)
+#float32 array. Raises an Exception naming the first position with the wrong number of kings or pieces.
+def coordinates(positions,mode="all pieces"):
+    n=len(positions)
+    columns=positions.transpose(0,2,1).reshape(n,64) #column by column, as ai.features
+    rows,squares=np.nonzero(columns) #only the few occupied squares are looked at from here on
+    values=columns[rows,squares]
+    limits={9:1,-9:1,5:2}
+    if mode=="all pieces":
+        limits.update({8:1,3:2})
+    found={}
+    for code,count in limits.items():
+        found[code]=find(rows,squares,values,n,code,count)
+    for code in (9,-9):
+        bad=np.flatnonzero(found[code][1]!=1)
+        if len(bad):
+            raise Exception("Incorrect number of kings in position "+str(bad[0])+". Expected 1 white king, 1 black king.")
+    for code in limits:
+        bad=np.flatnonzero(found[code][1]>limits[code])
+        if code not in (9,-9) and len(bad):
+            raise Exception("Incorrect number of pieces in position "+str(bad[0])+". Expected at most "+
+                            str(limits[code])+" of piece "+str(code)+", got "+str(found[code][1][bad[0]])+".")
+    order=[9,-9,8,5,3] if mode=="all pieces" else [9,-9,5]
+    return np.concatenate([found[code][0].reshape(n,-1) for code in order],axis=1)
+
+def planes(positions):
+    return (positions[:,None,:,:]==codes[None,:,None,None]).astype(np.float32)
+
+def recordType(mode):
+    return np.dtype([("position",np.int8,(8,8)),("features",np.float32,(ai.featureCount[mode],)),("value",np.float32)])
+
+#writes positions and their values into numbered shards in a directory, encoding each shard's features in one pass
+#when it is written. Call close to write the last, partly filled shard.
+class ShardWriter:
+    def __init__(self,directory,mode="all pieces",shardSize=1<<16,prefix="shard"):
+        os.makedirs(directory,exist_ok=True)
+        self.directory=directory
+        self.mode=mode
+        self.prefix=prefix
+        self.buffer=np.zeros(shardSize,dtype=recordType(mode))
+        self.n=0
+        self.paths=[]
+        self.count=0 #records written so far
+
+    #adds a stack of positions (seen from the side with the pieces) with one value each
+    def add(self,positions,values):
+        i=0
+        while i<len(positions):
+            k=min(len(positions)-i,len(self.buffer)-self.n)
+            self.buffer["position"][self.n:self.n+k]=positions[i:i+k]
+            self.buffer["value"][self.n:self.n+k]=values[i:i+k]
+            self.n+=k
+            i+=k
+            if self.n==len(self.buffer):
+                self.flush()
+
+    def flush(self):
+        if self.n==0:
+            return
+        shard=self.buffer[:self.n]
+        shard["features"]=coordinates(shard["position"],self.mode)
+        path=os.path.join(self.directory,self.prefix+"-"+str(len(self.paths)).zfill(5)+".npy")
+        np.save(path,shard)
+        self.paths.append(path)
+        self.count+=self.n
+        self.n=0
+
+    def close(self):
+        self.flush()
+
+#yields the shards written by ShardWriter in a directory, memory mapped, in order
+def readShards(directory,prefix="shard"):
+    for path in sorted(glob.glob(os.path.join(directory,prefix+"-*.npy"))):
+        yield np.load(path,mmap_mode="r")
+
+#plays games between two copies of the player spec (see tournament.Player) from random positions with the given
+#material against a lone king, both following the tables where they cover the position, yielding for each game the
+#positions with the side with the pieces to move, as an (n,8,8) array seen from that side, and their values in moves
+#to mate (see the module description). A material-only search on its own rarely mates, so without the tables most
+#games would end at maxPlies.
+def selfPlay(material,games,spec="minimax2@material",seed=0,maxPlies=200):
+    rng=random.Random(seed)
+    random.seed(seed)
+    player=Player(spec)
+    for g in range(games):
+        board=fromFen(randomPosition(material,rng))
+        ai.table.clear()
+        positions=[]
+        values=[] #from the tables, or None
+        plies=0
+        mated=False
+        while plies<maxPlies and np.count_nonzero(board.squares)>2:
+            legal=board.legalMoves()
+            if not legal:
+                mated=not board.isValid() and plies%2==1 #the lone king is mated
+                break
+            if plies%2==0:
+                positions.append(board.squares.copy())
+                r=tablebase.probe(board)
+                values.append(None if r==None else (None if r[0]==0 else r[0]*r[1]/2))
+            move=tablebase.bestMove(board)
+            board.make(move if move!=None else player.choose(board,legal,None))
+            board.flip()
+            plies+=1
+        #positions with a table value are always kept; the others only if the game ended in mate
+        keep=[i for i in range(len(positions)) if values[i]!=None or mated]
+        if not keep:
+            continue
+        yield (np.array([positions[i] for i in keep],dtype=np.int8),
+               np.array([values[i] if values[i]!=None else (plies-2*i)/2 for i in keep],dtype=np.float32))
+
+#checks coordinates and orient against ai.evalFeatures on n random positions of each mode, raising an
+#AssertionError on the first difference, and prints the time both take per position.
+def verify(n=5000):
+    rng=random.Random(0)
+    for mode,material in (("all pieces","KQRRBB"),("rooks only","KRR")):
+        ai.setMode(mode)
+        boards=[]
+        for i in range(n):
+            pieces="K"+"".join(c for c in material[1:] if rng.random()<0.6)
+            board=fromFen(randomPosition(pieces,rng))
+            if rng.random()<0.5:
+                board.flip() #the lone king to move, which orient flips back
+            boards.append(board)
+        t=time.perf_counter()
+        expected=[ai.evalFeatures(board) for board in boards]
+        slow=time.perf_counter()-t
+        t=time.perf_counter()
+        positions=np.stack([board.squares for board in boards])
+        oriented,signs=orient(positions)
+        features=coordinates(oriented,mode)
+        fast=time.perf_counter()-t
+        for i,(f,sign) in enumerate(expected):
+            assert features[i].tolist()==f and signs[i]==sign, "encoders disagree on\n"+str(boards[i])
+        assert planes(positions).sum()==np.count_nonzero(positions)
+        print(mode+": "+str(n)+" positions identical, ai.evalFeatures "+str(round(1e6*slow/n,1))+"us per position, "+
+              "orient+coordinates "+str(round(1e6*fast/n,2))+"us per position")
+    ai.setMode("all pieces")
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Write self-play training data for the evaluation networks.")
+    parser.add_argument("out",nargs="?",help="directory to write the shards to")
+    parser.add_argument("--material",default="KRR",help="the pieces played against a lone king (see tablebase.tableNames for those with tables)")
+    parser.add_argument("--games",type=int,default=100)
+    parser.add_argument("--player",default="minimax2@material",help="see tournament.py")
+    parser.add_argument("--mode",default="all pieces",choices=list(ai.featureCount))
+    parser.add_argument("--shard-size",type=int,default=1<<16)
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--verify",action="store_true",help="check the encoders instead")
+    args=parser.parse_args()
+    if args.verify:
+        verify()
+    elif args.out==None:
+        parser.error("the output directory is required")
+    else:
+        t=time.perf_counter()
+        writer=ShardWriter(args.out,args.mode,args.shard_size)
+        for positions,values in selfPlay(args.material,args.games,args.player,args.seed):
+            writer.add(positions,values)
+        writer.close()
+        print(str(writer.count)+" positions in "+str(len(writer.paths))+" shards in "+str(round(time.perf_counter()-t,1))+"s")
@@ -0,0 +1,113 @@
+import threading
+import traceback
+import ai
+
+'''
+Runs ai.pickMove in a background thread, so the pygame loop in main.py keeps drawing and handling events while a
+bot thinks:
+
+    engine=Engine(progress)
+    engine.submit(board,depth,seconds)  #board is seen from the side to move, as for ai.pickMove
+    ...
+    if engine.poll():                    #once per frame
+        move=engine.result               #the board after the move found, or None if there are no legal moves
+                                         #(engine.error holds the exception instead if the search raised one)
+
+ai keeps its search state in module globals, so only one search runs at a time: submit and ponder cancel any search
+already running, and nothing else may call into ai while the engine is busy. cancel stops the search through
+ai.cancelled and waits for the thread to end -- call it before the program exits.
+
+Pondering: after the bot has moved, ponder searches the position after the reply it expects (the second move of its
+principal variation) while the opponent thinks. If the opponent plays that reply and the ponder search has finished,
+submit takes its move without searching again. Otherwise the search starts over, but with the transposition table
+the ponder search filled.
+
+A thread rather than a process, so that pondering fills the table the real search uses and the model is loaded once.
+Most of a search's time is spent in torch, which releases the GIL; with the material evaluator the search still
+yields the GIL every few milliseconds, which is plenty for drawing.
+'''
+
+#returns a copy of board for the search thread. Unlike Board.copy it keeps the en passant square.
+def snapshot(board):
+    b=board.copy()
+    b.enPassant=board.enPassant
+    b.hash=board.hash
+    b.flipHash=board.flipHash
+    return b
+
+class Engine:
+    def __init__(self,progress=None):
+        self.progress=progress #called from the search thread with a dict like ai.searchInfo after each depth
+        self.thread=None
+        self.ready=False #whether the last search finished (and was not cancelled)
+        self.result=None
+        self.error=None #the exception the last search raised, if any
+        self.info=None #the last progress dict of the current search
+        self.pondering=None #(hash of the position pondered on, depth) while pondering
+
+    def busy(self):
+        return self.thread!=None and self.thread.is_alive()
+
+    #runs in the search thread. An exception ends the search like a result would, so that poll does not wait forever.
+    def run(self,board,depth,timeLimit):
+        try:
+            result=ai.pickMove(board,depth,timeLimit,progress=self.report)
+        except Exception as e:
+            traceback.print_exc()
+            self.error=e
+            self.ready=True
+            return
+        if not ai.cancelled:
+            self.result=result
+            self.ready=True
+
+    def report(self,info):
+        self.info=info
+        if self.progress and self.pondering==None:
+            self.progress(info)
+
+    def start(self,board,depth,timeLimit):
+        self.ready=False
+        self.result=None
+        self.error=None
+        self.info=None
+        self.thread=threading.Thread(target=self.run,args=(snapshot(board),depth,timeLimit),daemon=True)
+        self.thread.start()
+
+    #starts searching board (seen from the side to move) to the given depth, stopping after timeLimit seconds.
+    def submit(self,board,depth,timeLimit=None):
+        if self.pondering!=None:
+            ponderHash,ponderDepth=self.pondering
+            self.pondering=None
+            if ponderHash==board.hash and ponderDepth>=depth and self.ready and self.error==None:
+                return #ponder hit: poll returns the move at once
+        self.cancel()
+        self.start(board,depth,timeLimit)
+
+    #returns True once the submitted search has finished; its move is then in result, or the exception it raised in
+    #error.
+    def poll(self):
+        return self.ready and self.pondering==None
+
+    #starts pondering to the given depth. board is the position after the engine's last move, seen from the
+    #opponent, and must be given before anything else is searched (the expected reply comes from ai.searchInfo).
+    def ponder(self,board,depth):
+        pv=ai.searchInfo.get("pv",[])
+        self.cancel()
+        if len(pv)<2 or pv[1] not in board.legalMoves():
+            return
+        guess=board.afterMove(pv[1]).flip()
+        self.pondering=(guess.hash,depth)
+        self.start(guess,depth,None)
+
+    #stops the running search, if any, and waits for its thread to end. Its result is dropped.
+    def cancel(self):
+        if self.thread!=None:
+            ai.cancelled=True
+            self.thread.join()
+            ai.cancelled=False
+            self.thread=None
+        self.ready=False
+        self.result=None
+        self.error=None
+        self.pondering=None
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+
+'''
+Bounded cache of evaluations for ai.value, keyed by the model's feature tuple (see ai.features).
+
+The networks only see piece coordinates, so positions that differ only in castling rights, en passant or
+whose turn it is share an entry. When full, the least recently used entry is evicted. hits, misses and
+evictions count lookups and evictions since the last clear, to measure how well the cache works.
+'''
+
+class EvalCache:
+    def __init__(self,capacity=1<<16):
+        self.entries=OrderedDict()
+        self.resize(capacity)
+
+    #sets the maximum number of entries, evicting the least recently used ones if there are too many.
+    def resize(self,capacity):
+        self.capacity=max(1,capacity)
+        self.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    #empties the cache and resets the counters -- call when the model changes.
+    def clear(self):
+        self.entries.clear()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    #returns the value stored for key, or None.
+    def get(self,key):
+        v=self.entries.get(key)
+        if v==None:
+            self.misses+=1
+            return None
+        self.hits+=1
+        self.entries.move_to_end(key)
+        return v
+
+    def put(self,key,v):
+        self.entries[key]=v
+        self.entries.move_to_end(key)
+        if len(self.entries)>self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions+=1
+
+    def hitRate(self):
+        n=self.hits+self.misses
+        return self.hits/n if n else 0.0
+
+    def __repr__(self):
+        return ("EvalCache("+str(len(self))+"/"+str(self.capacity)+" entries, "+str(self.hits)+" hits, "+
+                str(self.misses)+" misses, "+str(self.evictions)+" evictions)")
@@ -1,12 +1,13 @@
 from board import Board
 import pygame
-import numpy as np
 from math import floor
-from ai import pickMove
+from engine import Engine
+from bitboard import squareName
 
 p1="human" #white player -- "human" or "botx", x=0: use random moves. x>0: use smartMove method with depth=x
 p2="human" #black player -- "human" or "botx" as above
 graphicSwap=1
+botTime=2 #seconds a bot may think per move -- it searches deeper up to its depth while time allows
 
 lastMove=None #used for debugging purposes.
 
@@ -21,27 +22,36 @@ def getDepth(x):
                 return int(p2[-1])
     return None
 
-class Graphic:
-    pieces={
-        1:"pawn",
-        2:'knight',
-        3:'bishop',
-        5:'rook',
-        8:'queen',
-        9:'king'
-        }
-    for piece in pieces.keys():
-        pieces[piece]=[
-            pygame.image.load(pieces[piece]+"-black.png"),
-            pygame.image.load(pieces[piece]+"-white.png")
+pieceNames={
+    1:"pawn",
+    2:'knight',
+    3:'bishop',
+    5:'rook',
+    8:'queen',
+    9:'king'
+    }
+
+#loads the images Graphic draws with. Done when the first Graphic is made rather than at import,
+#so this module can be imported without loading any files.
+def loadImages():
+    Graphic.pieces={}
+    for piece in pieceNames.keys():
+        Graphic.pieces[piece]=[
+            pygame.image.load(pieceNames[piece]+"-black.png"),
+            pygame.image.load(pieceNames[piece]+"-white.png")
             ]
-    sq=[pygame.image.load("sq-black.png"),pygame.image.load("sq-white.png")]
-    highlightGraphic=pygame.image.load("sq-highlight.png")
-    captureGraphic=pygame.image.load("sq-takable.png")
-    threatGraphic=pygame.image.load("sq-threat.png")
-    promotionGraphic=pygame.Surface((60*5,60*2))
-    promotionGraphic.fill((140,140,200))
+    Graphic.sq=[pygame.image.load("sq-black.png"),pygame.image.load("sq-white.png")]
+    Graphic.highlightGraphic=pygame.image.load("sq-highlight.png")
+    Graphic.captureGraphic=pygame.image.load("sq-takable.png")
+    Graphic.threatGraphic=pygame.image.load("sq-threat.png")
+    Graphic.promotionGraphic=pygame.Surface((60*5,60*2))
+    Graphic.promotionGraphic.fill((140,140,200))
+
+class Graphic:
+    pieces=None #set by loadImages, along with the other images
     def __init__(self,board):
+        if Graphic.pieces==None:
+            loadImages()
         self.board=board
         self.moving=None
         self.highlighted={}
@@ -49,30 +59,55 @@ class Graphic:
         self.promoting=False
         self.promotingKeys=[]
         self.swap=1 #displays black as white and white as black if this is -1.
+        self.engine=Engine(self.showProgress) #searches for the bots in the background
+        self.thinking=False #whether a bot's search is running
+        self.botDepth=None
+        self.botWhite=True
+        self.botQueue=[] #(depth, white) of bots to move after the current one, in bot vs bot games
+        self.status="" #shown in the window title while a bot thinks
+        self.surface=pygame.Surface((8*60,8*60)) #the board as last drawn by display
+        self.drawn={} #(piece, (highlighted, capturable)) of each square on self.surface
+        self.drawnPromoting=False
 
+    #draws the board onto screen at location and returns the rectangles of screen drawn on.
+    #Squares are composited into self.surface and only redrawn when their piece or highlight changed since the
+    #last call, so an unchanged board draws nothing. first redraws every square (e.g. after the screen was cleared).
     def display(self,screen,location,first=True):
         x,y=location
+        promoting=bool(self.promoting)
+        if first or promoting!=self.drawnPromoting:
+            #the promotion box covers squares, so they are all redrawn when it opens or closes
+            self.drawn={}
+            self.drawnPromoting=promoting
+        rects=[]
         for i in range(8):
             for j in range(8):
-                a=x+60*i
-                b=y+60*j
-                screen.blit(Graphic.sq[(i+j)%2==0],(a,b))
                 p=self.board.getSqr((i,j))*self.swap
+                overlay=(i,j) in self.highlighted.keys(),(i,j) in self.capturable.keys()
+                if self.drawn.get((i,j))==(p,overlay):
+                    continue
+                self.drawn[(i,j)]=(p,overlay)
+                a=60*i
+                b=60*j
+                self.surface.blit(Graphic.sq[(i+j)%2==0],(a,b))
                 if p!=0:
                     k=1
                     if p not in Graphic.pieces.keys():
                         p=-p
                         k=0
                     graphic=Graphic.pieces[p][k]
-                    screen.blit(graphic,(a,b))
-                if (i,j) in self.highlighted.keys():
-                    screen.blit(Graphic.highlightGraphic,(a,b))
-                elif (i,j) in self.capturable.keys():
-                    screen.blit(Graphic.captureGraphic,(a,b))
-        if self.promoting:
+                    self.surface.blit(graphic,(a,b))
+                if overlay[0]:
+                    self.surface.blit(Graphic.highlightGraphic,(a,b))
+                elif overlay[1]:
+                    self.surface.blit(Graphic.captureGraphic,(a,b))
+                rect=pygame.Rect(a,b,60,60)
+                screen.blit(self.surface,rect.move(x,y),rect)
+                rects.append(rect.move(x,y))
+        if promoting and rects:
             y+=60*3
             x+=60*2-30
-            screen.blit(self.promotionGraphic,(x,y))
+            rects.append(screen.blit(self.promotionGraphic,(x,y)))
             x+=30
             y+=30
             for p in range(len(self.promotingKeys)):
@@ -81,6 +116,7 @@ class Graphic:
                 else:
                     screen.blit(Graphic.pieces[self.promotingKeys[p]][0],(x,y))
                 x+=60
+        return rects
 
     def reset(self):
         self.moving=None
@@ -89,33 +125,77 @@ class Graphic:
         self.promoting=False
         self.promotingKeys=[]
 
-    def botMove(self,x):
+    #starts the move of the bot playing white (if white) or black. Random moves are made at once, searches run
+    #in the engine and are played by update once they finish.
+    def botMove(self,x,white):
         global lastMove
-        lastMove=board.board.copy() #used for debugging
+        lastMove=self.board.copy() #used for debugging
+        self.botDepth=x
+        self.botWhite=white
         if x==None:
-            move=self.board.randomMove()
+            self.finishBotMove(self.board.randomMove())
         else:
-            move=pickMove(board.board,x)#Chain(self.board,x).minimax()
+            self.thinking=True
+            self.status="thinking"
+            self.engine.submit(self.board,x,botTime)
+            self.board.flip() #the engine searches a copy: show the board the other way up again while it does
+
+    #called every frame: plays the bot's move once the engine has found it, or gives up on it if the search failed
+    def update(self):
+        if self.thinking and self.engine.poll():
+            self.thinking=False
+            if self.engine.error!=None:
+                print("The bot's search failed: "+repr(self.engine.error))
+                self.status="search failed"
+                self.botQueue=[]
+                return
+            self.board.flip() #back to the bot's view, as finishBotMove expects
+            self.finishBotMove(self.engine.result)
+
+    #plays the bot's move (the board after it, or None if it has no legal moves) and hands over to the other side
+    def finishBotMove(self,move):
+        self.status=""
         if move==None:
             if self.board.isValid():
                 print("Stalemate!")
             else:
                 print("You win!")
-            return False
-        else:
-            self.board=move
-        return True
+            self.botQueue=[]
+            return
+        self.board=move
+        self.board.flip()
+        if self.botQueue:
+            self.botMove(*self.botQueue.pop(0))
+        elif "human" in [p1,p2]:
+            if self.board.legalMoves()==[]:
+                print("You lose!")
+            elif self.botDepth!=None:
+                self.engine.ponder(self.board,self.botDepth)
+
+    #progress callback of the engine, run in its thread: shows the depth reached and the best move so far
+    def showProgress(self,info):
+        move=info["pv"][0]
+        self.status=("thinking, depth "+str(info["depth"])+": "+squareName(move.start,self.botWhite)+
+                     squareName(move.end,self.botWhite))
+
+    #plays the move of the human's opponent, if it is a bot
+    def opponentMove(self):
+        if "bot" in [p1[:3],p2[:3]]:
+            if p1=="human":
+                self.botMove(getDepth(2),False)
+            else:
+                self.botMove(getDepth(1),True)
 
     #process a click
     def click(self,pos):
+        if self.thinking:
+            return
         if p1[:3]==p2[:3] and p1[:3]=="bot":
             m1=getDepth(1)
             m2=getDepth(2)
             if p1=="bot":
-                if self.botMove(m1):
-                    self.board.flip()
-                    self.botMove(m2)
-                    self.board.flip()
+                self.botQueue=[(m2,False)]
+                self.botMove(m1,True)
             return
         x0,y0=pos
         x=floor(x0/60)
@@ -127,61 +207,26 @@ class Graphic:
             x0=floor(x0/60)
             y0=floor(y0/60)
             if y0==0 and x0 in range(len(self.promotingKeys)):
-                self.board=self.promoting[self.promotingKeys[x0]]
+                self.board=self.board.afterMove(self.promoting[self.promotingKeys[x0]])
                 self.reset()
                 self.board.flip()
-                if "bot" in [p1[:3],p2[:3]]:
-                    if p1=="human":
-                        self.botMove(getDepth(2))
-                    else:
-                        self.botMove(getDepth(1))
-                    self.board.flip()
+                self.opponentMove()
         elif self.moving==None:
             self.moving=(x,y)
             piece=self.board.getSqr(self.moving)
             if piece<=0:
                 self.reset()
             else:
-                moves=self.board.movesFrom((x,y))
-                for move in moves:
-                    array=np.array(self.board.squares-move.squares)
-                    b,a=np.where(array<0)
-                    s=np.sum(array)
-                    if 1 in array[1,:]:
-                        #this should be a promotion move
-                        a=int(a)
-                        b=int(b)
-                        p=move.squares[b][a]
-                        if (a,b) in self.highlighted.keys():
-                            self.highlighted[(a,b)][p]=move
-                        else:
-                            self.highlighted[(a,b)]={p:move}
-                    elif s==-1 and len(a)>1:
-                        #this move is an en passant
-                        d,c=np.where(array>0)
-                        d-=1
-                        if c+1 in a:
-                            self.capturable[(int(c+1),int(d))]=move
-                        else:
-                            self.capturable[(int(c-1),int(d))]=move
-                    elif len(a)>1:
-                        #castle
-                        if array[7][6]!=0:
-                            #right castle
-                            if (6,7) not in self.highlighted.keys():
-                                self.highlighted[(6,7)]=move
-                        elif array[7][2]!=0:
-                            #left castle
-                            if (2,7) not in self.highlighted.keys():
-                                self.highlighted[(2,7)]=move
+                for (a,b),moves in self.board.moveTargets((x,y)).items():
+                    move=moves[0]
+                    if move.promotion:
+                        self.highlighted[(a,b)]={m.promotion:m for m in moves}
+                    elif move.captured:
+                        #includes en passant, which is shown on the square the pawn moves to
+                        self.capturable[(a,b)]=move
                     else:
-                        #any other move goes here
-                        a=int(a)
-                        b=int(b)
-                        if ((a,b) not in self.highlighted.keys()) and s==0:
-                            self.highlighted[(a,b)]=move
-                        elif ((a,b) not in self.capturable.keys()) and s<0:
-                            self.capturable[(a,b)]=move
+                        #castling is shown on the king's destination
+                        self.highlighted[(a,b)]=move
         else:
             #move the selected piece
             piece=self.board.getSqr(self.moving)
@@ -191,20 +236,13 @@ class Graphic:
                         self.promoting=self.highlighted[(x,y)]
                         self.promotingKeys=list(self.promoting.keys())
                     else:
-                        self.board=self.highlighted[(x,y)]
+                        self.board=self.board.afterMove(self.highlighted[(x,y)])
                 else:
-                    self.board=self.capturable[(x,y)]
+                    self.board=self.board.afterMove(self.capturable[(x,y)])
                 if not self.promoting:
                     self.board.flip()
-                if (not self.promoting) and "bot" in [p1[:3],p2[:3]]:
-                    move=self.board.randomMove()
-                    if p1=="human":
-                        self.botMove(getDepth(2))
-                    else:
-                        self.botMove(getDepth(1))
-                    self.board.flip()
-                    if self.board.allMoves()==[]:
-                        print("You lose!")
+                if not self.promoting:
+                    self.opponentMove()
                 if not (self.promoting) and "bot" not in [p1[:3],p2[:3]]:
                     if self.swap==1:
                         self.swap=-1
@@ -214,55 +252,75 @@ class Graphic:
                 self.reset()
                 
 
-pygame.init()
-X=8*60
-Y=8*60
-bgColor=(100,100,180)
+def main():
+    pygame.init()
+    X=8*60
+    Y=8*60
+    bgColor=(100,100,180)
 
-screen=pygame.display.set_mode((X,Y),pygame.RESIZABLE)
-pygame.display.set_caption("Chess AI")
-screen.fill(bgColor)
+    screen=pygame.display.set_mode((X,Y),pygame.RESIZABLE)
+    pygame.display.set_caption("Chess AI")
+    screen.fill(bgColor)
 
-blitLoc=(X/2-4*60,Y/2-4*60)
-board=Graphic(Board())
+    blitLoc=(X/2-4*60,Y/2-4*60)
+    board=Graphic(Board())
 
-pygame.display.flip()
-status = True
-first=True
+    pygame.display.flip()
+    status = True
+    first=True
 
-if p1[:3]=="bot" and p2=="human":
-    board.botMove(getDepth(1))
-    board.swap=-1
-    board.board.flip()
+    if p1[:3]=="bot" and p2=="human":
+        board.swap=-1
+        board.botMove(getDepth(1),True)
+    caption=""
 
-while (status):
-    for event in pygame.event.get():
-        #handles what happens if the window's x is pressed.
-        if event.type == pygame.QUIT:
-            status = False
+    while (status):
+        #sleeps until something happens, waking up every 60ms while a bot thinks to check on it
+        events=[pygame.event.wait(60 if board.thinking else 0)]+pygame.event.get()
+        for event in events:
+            #handles what happens if the window's x is pressed.
+            if event.type == pygame.QUIT:
+                status = False
+                board.engine.cancel()
 
-        #handles window resizing.
-        elif event.type==pygame.VIDEORESIZE:
-            X=event.w
-            Y=event.h
-            #Ensure minimum size...
-            if X<=60*8:
-                X=60*8
-            if Y<=60*8:
-                Y=60*8
-            screen=pygame.display.set_mode((X,Y),pygame.RESIZABLE) 
-            blitLoc=(X/2-4*60,Y/2-4*60) #update blitLoc
+            #handles window resizing.
+            elif event.type==pygame.VIDEORESIZE:
+                X=event.w
+                Y=event.h
+                #Ensure minimum size...
+                if X<=60*8:
+                    X=60*8
+                if Y<=60*8:
+                    Y=60*8
+                screen=pygame.display.set_mode((X,Y),pygame.RESIZABLE) 
+                blitLoc=(X/2-4*60,Y/2-4*60) #update blitLoc
+                first=True
 
-        #process clicks.
-        elif event.type==pygame.MOUSEBUTTONDOWN:
-            pos=pygame.mouse.get_pos()
-            board.click((pos[0]-blitLoc[0],pos[1]-blitLoc[1]))
+            #redraws everything when the window's contents were lost (e.g. it was uncovered).
+            elif event.type==pygame.VIDEOEXPOSE:
+                first=True
 
-    #update the graphics.
-    screen.fill(bgColor)
-    board.display(screen,blitLoc,first)
-    pygame.display.flip()
-    first=False
-    pygame.time.wait(60)
+            #process clicks.
+            elif event.type==pygame.MOUSEBUTTONDOWN:
+                pos=pygame.mouse.get_pos()
+                board.click((pos[0]-blitLoc[0],pos[1]-blitLoc[1]))
+
+        board.update()
+        if board.status!=caption:
+            caption=board.status
+            pygame.display.set_caption("Chess AI"+(" - "+caption if caption else ""))
+
+        #update the graphics, only where they changed.
+        if first:
+            screen.fill(bgColor)
+        rects=board.display(screen,blitLoc,first)
+        if first:
+            pygame.display.flip()
+        elif rects:
+            pygame.display.update(rects)
+        first=False
+
+    pygame.quit()
 
-pygame.quit()
+if __name__=="__main__":
+    main()
@@ -0,0 +1,168 @@
+import sys
+import numpy as np
+from board import Board
+from bitboard import toSquare
+
+'''
+Perft (move path enumeration) for Board, used to check the move generator.
+Run "python perft.py [depth]" to check that the bitboard and array backends generate identical moves
+for every position up to the given depth (default 2) in the positions below, and that the hash tells apart
+the same array reached in the searches of either side (see checkSides).
+'''
+
+fenPieces={'p':1,'n':2,'b':3,'r':5,'q':8,'k':9}
+
+#builds a board from a FEN string, seen from the side to move (i.e. flipped if black is to move)
+def fromFen(fen):
+    fields=fen.split()
+    array=np.zeros((8,8),dtype=np.int8)
+    for y,row in enumerate(fields[0].split("/")):
+        x=0
+        for c in row:
+            if c.isdigit():
+                x+=int(c)
+            else:
+                p=fenPieces[c.lower()]
+                array[y][x]=p if c.isupper() else -p
+                x+=1
+    rights=fields[2] if len(fields)>2 else "-"
+    moved=[
+        "K" not in rights and "Q" not in rights,
+        "k" not in rights and "q" not in rights,
+        "Q" not in rights,
+        "K" not in rights,
+        "q" not in rights,
+        "k" not in rights
+        ]
+    board=Board(array,moved)
+    if len(fields)>3 and fields[3]!="-":
+        board.enPassant=(ord(fields[3][0])-ord("a"),8-int(fields[3][1]))
+    board.rehash()
+    if len(fields)>1 and fields[1]=="b":
+        board.flip()
+    return board
+
+#the reverse of fromFen: board is seen from the side to move, which is black if blackToMove.
+#move counters are not tracked by Board, so they are given as "0 1".
+def toFen(board,blackToMove=False):
+    enPassant=board.enPassant
+    if blackToMove:
+        board=board.copy().flip()
+        if enPassant!=(-1,-1):
+            enPassant=(enPassant[0],7-enPassant[1])
+    names={v:k for k,v in fenPieces.items()}
+    rows=[]
+    for row in board.squares.tolist():
+        text=""
+        empty=0
+        for p in row:
+            if p==0:
+                empty+=1
+                continue
+            if empty:
+                text+=str(empty)
+                empty=0
+            text+=names[p].upper() if p>0 else names[-p]
+        if empty:
+            text+=str(empty)
+        rows.append(text)
+    moved=board.moved
+    rights=(("K" if not moved[0] and not moved[3] else "")+("Q" if not moved[0] and not moved[2] else "")+
+            ("k" if not moved[1] and not moved[5] else "")+("q" if not moved[1] and not moved[4] else ""))
+    passant="-" if enPassant==(-1,-1) else chr(ord("a")+enPassant[0])+str(8-enPassant[1])
+    return "/".join(rows)+" "+("b" if blackToMove else "w")+" "+(rights or "-")+" "+passant+" 0 1"
+
+positions={
+    "start":"rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "castling":"r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1",
+    "castling through check":"r3k2r/8/8/8/8/8/5b2/R3K2R w KQkq - 0 1",
+    "en passant":"4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1",
+    "en passant pin":"8/8/8/K2pP2r/8/8/8/4k3 w - d6 0 1",
+    "promotion":"r1n1k3/1P6/8/8/8/8/8/4K3 w - - 0 1",
+    "black to move":"rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1",
+    "kiwipete":"r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "rook endgame":"8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "checks and pins":"r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+    }
+
+#counts the leaf nodes of the move tree to the given depth
+def perft(board,depth):
+    if depth==0:
+        return 1
+    moves=board.legalMoves()
+    if depth==1:
+        return len(moves)
+    n=0
+    for move in moves:
+        board.make(move)
+        board.flip()
+        n+=perft(board,depth-1)
+        board.flip()
+        board.unmake(move)
+    return n
+
+#a hashable summary of everything a move changes about a board
+def key(board):
+    return (board.squares.tobytes(),tuple(board.moved),board.enPassant,board.whiteKingPos,board.blackKingPos,board.hash)
+
+#returns the moves of the given board with the given backend
+def movesWith(board,backend):
+    old=Board.backend
+    Board.backend=backend
+    try:
+        return board.allMoves()
+    finally:
+        Board.backend=old
+
+#checks that both backends produce identical moves (and validity) at every node to the given depth,
+#that unmake restores the board after every move, and that the incremental hashes are right.
+#returns the number of leaf nodes, raising an AssertionError on the first difference.
+def compare(board,depth):
+    fast=movesWith(board,"bitboard")
+    slow=movesWith(board,"array")
+    a=sorted(key(b) for b in fast)
+    b=sorted(key(b) for b in slow)
+    assert a==b, "backends disagree on\n"+str(board)+"\nbitboard: "+str(len(a))+" moves, array: "+str(len(b))+" moves"
+    assert board.isValid()==board.isValidArray(), "backends disagree on check in\n"+str(board)
+    assert (board.hash,board.flipHash)==board.computeHash(), "incremental hash is wrong in\n"+str(board)
+    before=key(board)
+    for move in board.legalMoves():
+        board.make(move)
+        assert (board.hash,board.flipHash)==board.computeHash(), "incremental hash is wrong after "+str(move)+" in\n"+str(board)
+        board.unmake(move)
+        assert key(board)==before, "unmake did not restore the board after "+str(move)+" in\n"+str(board)
+    if depth<=1:
+        return len(fast)
+    n=0
+    for b in fast:
+        b.flip()
+        n+=compare(b,depth-1)
+    return n
+
+#makes the move between the given (x,y) indices on board
+def play(board,start,end):
+    board.make(next(m for m in board.legalMoves() if m.start==toSquare(start) and m.end==toSquare(end)))
+
+#checks that the hash of a position includes which colour the board is seen from. After 1.Nf3 Nf6, white's root board
+#and the node black's search reaches by Nf6 (seen from black, like every node of black's search) hold the same array
+#with the same turn, but white is to move in one and black in the other, so the transposition table the two searches
+#share must not mix them up. Raises an AssertionError if it would.
+def checkSides():
+    board=Board()
+    play(board,(6,7),(5,5)) #Nf3
+    board.flip()
+    node=board.copy()
+    play(node,(6,7),(5,5)) #Nf6, in black's search
+    play(board,(6,7),(5,5)) #Nf6, played
+    board.flip()
+    assert (board.squares==node.squares).all() and board.turn==node.turn
+    assert board.hash!=node.hash, "white's and black's searches share a hash for different sides to move"
+    for b in (board,node):
+        assert (b.hash,b.flipHash)==b.computeHash(), "incremental hash is wrong in\n"+str(b)
+
+if __name__=="__main__":
+    depth=int(sys.argv[1]) if len(sys.argv)>1 else 2
+    for name,fen in positions.items():
+        print(name+":",compare(fromFen(fen),depth),"nodes identical")
+    checkSides()
+    print("sides: hashes differ")
@@ -0,0 +1,296 @@
+import os
+import sys
+import time
+import numpy as np
+import random
+from board import Board
+from bitboard import kingTable, rookAttacks, bishopAttacks
+
+'''
+Endgame tablebases for the material the evaluation networks support: K+R, K+Q, K+R+R and K+B+B against a lone king.
+
+    python tablebase.py [KR KQ KRR KBB ...]
+
+generates the given tables (default: all of them) by retrograde analysis into the tables directory. Each table is an
+.npy file of uint8 holding, for white (the side with the pieces) to move and for black (the lone king) to move, the
+distance to mate in plies plus one for every position, or 0 for draws and impossible positions. Positions are indexed
+by the squares (s=8*y+x, as in bitboard.py) of the white king, black king and white pieces, 6 bits each, in that order.
+There are no pawns, so a position and its mirror image have the same value and the tables can be probed from either
+side's point of view.
+
+probe looks positions up, memory mapping the files the first time each table is needed, and bestMove finds the
+move the tables say is best.
+'''
+
+directory="tables"
+pieceNames={5:"R",8:"Q",3:"B"}
+#tables to generate, in order: a table is generated after the tables its captures lead to
+tableNames=["KR","KQ","KRR","KBB"]
+
+#uint64 attack tables of a slider of each kind from square p with a single blocker on b (no blocker if b==p).
+#The attacks of a slider with several blockers are the intersection of its attacks with each of them.
+def _sliderTable(attacks):
+    table=np.zeros((64,64),dtype=np.uint64)
+    for p in range(64):
+        for b in range(64):
+            table[p][b]=attacks(p,0 if b==p else 1<<b)
+    return table
+
+_sliders=None
+
+def sliderTables():
+    global _sliders
+    if _sliders==None:
+        rook=_sliderTable(rookAttacks)
+        bishop=_sliderTable(bishopAttacks)
+        _sliders={5:rook,3:bishop,8:rook|bishop}
+    return _sliders
+
+def _stepArray(table):
+    return np.array(table,dtype=np.uint64)
+
+kingArray=_stepArray(kingTable)
+kingSteps=[(dx,dy) for dx in (-1,0,1) for dy in (-1,0,1) if (dx,dy)!=(0,0)]
+straightSteps=[(1,0),(-1,0),(0,1),(0,-1)]
+diagonalSteps=[(1,1),(1,-1),(-1,1),(-1,-1)]
+pieceSteps={5:straightSteps,3:diagonalSteps,8:straightSteps+diagonalSteps}
+
+#stepTo[dx,dy][k][s]: the square k steps from s in the direction (dx,dy), -1 if off the board
+def _stepTo(dx,dy):
+    ret=np.full((8,64),-1,dtype=np.int64)
+    for s in range(64):
+        for k in range(1,8):
+            x,y=s%8+k*dx,s//8+k*dy
+            if 0<=x<8 and 0<=y<8:
+                ret[k][s]=8*y+x
+    return ret
+
+stepTo={(dx,dy):_stepTo(dx,dy) for dx,dy in kingSteps}
+
+#the square of each piece in the positions with the given indices: white king, black king, white pieces
+def squaresOf(idx,n):
+    shift=6*(n+1)
+    return [(idx>>(shift-6*i))&63 for i in range(n+2)]
+
+#generates the table for the given white pieces, e.g. [5,5] for K+R+R against K. returns (white to move, black to move).
+def generate(pieces,log=print):
+    start=time.perf_counter()
+    n=len(pieces)
+    size=1<<(6*(n+2))
+    sliders=sliderTables()
+    wtm=np.zeros(size,dtype=np.uint8)
+    btm=np.zeros(size,dtype=np.uint8)
+    wtmLegal=np.zeros(size,dtype=bool)
+    quiet=np.zeros(size,dtype=np.uint8) #bit d set if the black king can move (without capturing) in kingSteps[d]
+    escape=np.zeros(size,dtype=bool) #black can capture its way to a draw
+    captureMax=np.zeros(size,dtype=np.int16) #longest mate (plies) after a capture by black, -1 if black cannot capture
+    #work through one white king square at a time to keep memory use down
+    chunk=1<<(6*(n+1))
+    for w in range(64):
+        rows=slice(w*chunk,(w+1)*chunk)
+        squares=squaresOf(np.arange(w*chunk,(w+1)*chunk,dtype=np.int64),n)
+        wK,bK=squares[0],squares[1]
+        own=squares[2:]
+        legal=~((np.abs((wK&7)-(bK&7))<=1)&(np.abs((wK>>3)-(bK>>3))<=1)) #kings apart
+        for i in range(len(squares)):
+            for j in range(i+1,len(squares)):
+                legal&=squares[i]!=squares[j]
+        #squares attacked by white, with the black king not blocking anything
+        attacked=kingArray[wK]
+        for i in range(n):
+            a=sliders[pieces[i]][own[i],wK]
+            for j in range(n):
+                if j!=i:
+                    a&=sliders[pieces[i]][own[i],own[j]]
+            attacked|=a
+        check=((attacked>>bK.astype(np.uint64))&np.uint64(1)).astype(bool)
+        wtmLegal[rows]=legal&~check
+        q=np.zeros(chunk,dtype=np.uint8)
+        capMax=np.full(chunk,-1,dtype=np.int16)
+        esc=np.zeros(chunk,dtype=bool)
+        for d,(dx,dy) in enumerate(kingSteps):
+            t=stepTo[dx,dy][1][bK]
+            ok=legal&(t>=0)
+            t=np.where(ok,t,0)
+            ok&=~((attacked>>t.astype(np.uint64))&np.uint64(1)).astype(bool)
+            captured=np.zeros(chunk,dtype=bool)
+            for i in range(n):
+                hit=ok&(t==own[i])
+                captured|=hit
+                if not hit.any():
+                    continue
+                #the position after the capture, white to move, in the table without piece i
+                rest=pieces[:i]+pieces[i+1:]
+                sub=subtable(rest)
+                if sub is None:
+                    esc|=hit
+                    continue
+                subIdx=(wK<<(6*len(rest)+6))|(t<<(6*len(rest)))
+                for j,p in enumerate([own[k] for k in range(n) if k!=i]):
+                    subIdx|=p<<(6*(len(rest)-1-j))
+                v=sub[0][np.where(hit,subIdx,0)].astype(np.int16)
+                esc|=hit&(v==0)
+                capMax=np.where(hit,np.maximum(capMax,v-1),capMax)
+            q|=((ok&~captured).astype(np.uint8)<<d)
+        quiet[rows]=q
+        escape[rows]=esc|~legal
+        captureMax[rows]=capMax
+        #mated: in check with no moves at all. stalemates are left at 0 (a draw), and so not in open_ below
+        btm[rows]=(legal&check&(q==0)&(capMax<0)&~esc).astype(np.uint8)
+    log(str(size)+" positions set up in "+str(round(time.perf_counter()-start,1))+"s, "+str(int((btm==1).sum()))+" mates")
+    lost=np.flatnonzero(btm==1) #black to move positions lost in exactly plies-1 plies
+    open_=np.flatnonzero(~escape&(btm==0)&((quiet>0)|(captureMax>=0))) #black to move positions not yet decided
+    longestCapture=int(captureMax.max())
+    plies=0
+    while len(lost) or plies<=longestCapture:
+        #white to move: won in plies+1 if a move reaches a position in lost
+        plies+=1
+        squares=squaresOf(lost,n)
+        for i in range(n+1):
+            t=squares[0] if i==0 else squares[i+1]
+            shift=6*(n+1) if i==0 else 6*(n-i)
+            others=[squares[k] for k in range(n+2) if k!=(0 if i==0 else i+1)]
+            steps=kingSteps if i==0 else pieceSteps[pieces[i-1]]
+            for dx,dy in steps:
+                alive=np.ones(len(lost),dtype=bool)
+                for k in range(1,2 if i==0 else 8):
+                    s=stepTo[dx,dy][k][t]
+                    alive&=s>=0
+                    for o in others:
+                        alive&=s!=o
+                    if not alive.any():
+                        break
+                    pred=lost[alive]+((s[alive]-t[alive])<<shift)
+                    wtm[pred[wtmLegal[pred]&(wtm[pred]==0)]]=plies+1
+        won=int(np.count_nonzero(wtm==plies+1))
+        #black to move: lost in plies+1 if every move reaches a position white has won by now
+        plies+=1
+        done=captureMax[open_]<plies
+        q=quiet[open_]
+        for d,(dx,dy) in enumerate(kingSteps):
+            has=((q>>d)&1).astype(bool)
+            succ=open_+((dx+8*dy)<<(6*n))
+            done&=~has|((wtm[np.where(has,succ,0)]>0)&has)
+        lost=open_[done]
+        btm[lost]=plies+1
+        open_=open_[~done]
+        log("mate in "+str(plies-1)+" plies with white to move: "+str(won)+", in "+str(plies)+" with black to move: "+str(len(lost)))
+    log("done in "+str(round(time.perf_counter()-start,1))+"s")
+    return (wtm,btm)
+
+def tableName(pieces):
+    return "K"+"".join(pieceNames[p] for p in pieces)
+
+def tablePath(name):
+    return os.path.join(directory,name+".npy")
+
+tables={} #name -> memory mapped table, or None if there is no file for it
+
+#returns the table for the given white pieces (memory mapped), or None if it has not been generated
+def subtable(pieces):
+    name=tableName(sorted(pieces,reverse=True))
+    if name not in tables:
+        path=tablePath(name)
+        tables[name]=np.load(path,mmap_mode="r") if os.path.exists(path) else None
+    return tables[name]
+
+def save(name,wtm,btm):
+    os.makedirs(directory,exist_ok=True)
+    out=np.lib.format.open_memmap(tablePath(name),mode="w+",dtype=np.uint8,shape=(2,len(wtm)))
+    out[0]=wtm
+    out[1]=btm
+    out.flush()
+    del out
+    tables.pop(name,None)
+
+#looks the position up, board being seen from the player whose pieces are positive. side is 1 if that player is to
+#move, -1 if the other one is. returns (result, plies) from the side to move's point of view: result 1 if it mates
+#in plies half moves, -1 if it is mated in plies, 0 (and plies 0) for a draw.
+#returns None if there is no table for the position's material.
+def probe(board,side=1):
+    flat=board.squares.ravel()
+    occupied=np.flatnonzero(flat)
+    if len(occupied)>4 or len(occupied)<3:
+        return None
+    values=flat[occupied].tolist()
+    occupied=occupied.tolist()
+    attacker=1 if sum(1 for v in values if v>0)>1 else -1
+    pieces=sorted((attacker*v,s) for v,s in zip(values,occupied) if attacker*v>0 and attacker*v!=9)
+    if len(pieces)!=len(values)-2 or any(p not in pieceNames for p,s in pieces):
+        return None
+    if 5 in [p for p,s in pieces]:
+        #castling is not in the tables
+        moved=board.moved
+        if attacker==1 and not moved[0] and not (moved[2] and moved[3]):
+            return None
+        if attacker==-1 and not moved[1] and not (moved[4] and moved[5]):
+            return None
+    table=subtable([p for p,s in pieces])
+    if table is None:
+        return None
+    idx=(occupied[values.index(9*attacker)]<<6)|occupied[values.index(-9*attacker)]
+    for p,s in pieces:
+        idx=(idx<<6)|s
+    attackerToMove=side==attacker
+    v=int(table[0 if attackerToMove else 1][idx])
+    if v==0:
+        return (0,0)
+    return (1 if attackerToMove else -1,v-1)
+
+#returns the legal move of the side to move (board being seen from it) that the tables say is best -- the quickest
+#mate, failing that a draw, failing that the longest resistance -- or None if there is no table for the position.
+def bestMove(board):
+    if probe(board,1)==None:
+        return None
+    best=None
+    for move in board.legalMoves():
+        r=probe(board.afterMove(move).flip(),1) or (0,0) #the opponent's result; bare kings are a draw
+        key=(r[0],r[1] if r[0]==-1 else -r[1])
+        if best==None or key<best[0]:
+            best=(key,move)
+    return best[1] if best else None
+
+#checks the table for the given white pieces against Board's move generator on n random positions: a position's
+#value must follow from the values of the positions after each legal move. raises an AssertionError if not.
+def verify(pieces,n=1000,rng=None):
+    rng=rng or random.Random(0)
+    checked=0
+    while checked<n:
+        squares=rng.sample(range(64),len(pieces)+2)
+        array=np.zeros((8,8),dtype=np.int8)
+        for s,p in zip(squares,[9,-9]+pieces):
+            array[s>>3][s&7]=p
+        board=Board(array,[True]*6)
+        if abs((squares[0]&7)-(squares[1]&7))<=1 and abs((squares[0]>>3)-(squares[1]>>3))<=1:
+            continue
+        for side in (1,-1):
+            b=board if side==1 else board.copy().flip()
+            if not b.copy().flip().isValid():
+                continue #the side not to move is in check
+            result,plies=probe(b,1)
+            after=[]
+            for move in b.legalMoves():
+                r=probe(b.afterMove(move).flip(),1)
+                after.append(r if r!=None else (0,0)) #bare kings, or a table that is not generated, are draws
+            if not after:
+                expected=(-1,0) if not b.isValid() else (0,0)
+            elif any(r[0]==-1 for r in after):
+                expected=(1,min(p for r,p in after if r==-1)+1)
+            elif all(r[0]==1 for r in after):
+                expected=(-1,max(p for r,p in after)+1)
+            else:
+                expected=(0,0)
+            assert (result,plies)==expected, "table says "+str((result,plies))+", moves give "+str(expected)+" for\n"+str(b)
+            checked+=1
+    return checked
+
+if __name__=="__main__":
+    names=sys.argv[1:] if len(sys.argv)>1 else tableNames
+    codes={v:k for k,v in pieceNames.items()}
+    for name in names:
+        pieces=[codes[c] for c in name[1:]]
+        print(name+":")
+        wtm,btm=generate(pieces)
+        save(name,wtm,btm)
+        print("checked "+str(verify(pieces))+" positions against the move generator")
+        print("longest mate: "+str(int(wtm.max())-1)+" plies with white to move, "+str(int(btm.max())-1)+" with black to move")
@@ -0,0 +1,275 @@
+import time
+import random
+import argparse
+import multiprocessing
+import numpy as np
+from board import Board
+from bitboard import castle, squareName
+from perft import fromFen, toFen
+import ai
+
+'''
+Headless self-play tournament between bots. Does not import pygame.
+
+    python tournament.py PLAYER PLAYER [PLAYER ...] [--games N] [--material KRR] [--fen FEN ...]
+                         [--time SECONDS] [--max-plies N] [--workers N] [--seed N] [--pgn games.pgn]
+
+Players are given as:
+    random                  a random legal move (like "bot0" in main.py)
+    minimaxK                ai.pickMove to depth K with the default model
+    minimaxK@FILE           the same with the model in FILE (see ai.setModelFile)
+    minimaxK@material       the same with the material evaluator (no torch needed)
+
+Every pair of players plays --games games. The starting positions are random endgames with the given material
+for white against a lone black king (the material the networks know), or the --fen positions, each played twice
+so both players get both sides. Games are played in parallel worker processes and end in checkmate, stalemate,
+insufficient material, threefold repetition, the fifty move rule or after --max-plies half moves (a draw).
+Prints win/draw/loss statistics and the time each player took per move, and writes the games as PGN with --pgn.
+'''
+
+pieceLetters={2:"N",3:"B",5:"R",8:"Q",9:"K"}
+materialPieces={"Q":8,"R":5,"B":3,"N":2,"P":1}
+
+class Player:
+    def __init__(self,spec):
+        self.spec=spec
+        self.depth=None
+        self.model=None
+        if spec!="random":
+            name,_,model=spec.partition("@")
+            if not name.startswith("minimax") or not name[7:].isdigit():
+                raise Exception("Unknown player "+spec+". Expected random, minimaxK or minimaxK@FILE.")
+            self.depth=int(name[7:])
+            self.model=model or ai.modelFiles[ai.mode]
+
+    #sets the evaluator and model in ai this player searches with, if they are not set already
+    def configure(self):
+        if self.model=="material":
+            if ai.evaluator!="material":
+                ai.setEvaluator("material")
+            return
+        if ai.evaluator!="network":
+            ai.setEvaluator("network")
+        if ai.modelFiles[ai.mode]!=self.model:
+            ai.setModelFile(self.model)
+
+    #returns the move to play from the given legal moves, board being seen from the side to move
+    def choose(self,board,moves,timeLimit):
+        if self.depth==None:
+            return random.choice(moves)
+        self.configure()
+        ai.pickMove(board,self.depth,timeLimit)
+        return ai.searchInfo["pv"][0]
+
+#returns a random position with the given white material (e.g. "KRR") against a lone black king, white to move, as FEN
+def randomPosition(material,rng):
+    pieces=[9]+[materialPieces[c] for c in material.upper() if c!="K"]
+    while True:
+        array=np.zeros((8,8),dtype=np.int8)
+        squares=rng.sample(range(64),len(pieces)+1)
+        for s,p in zip(squares,pieces+[-9]):
+            array[s>>3][s&7]=p
+        if any(p==1 and s>>3 in (0,7) for s,p in zip(squares,pieces)):
+            continue
+        board=Board(array,[True]*6)
+        opponent=board.copy().flip()
+        if opponent.isValid() and board.legalMoves():
+            return toFen(board)
+
+#returns the move in standard algebraic notation, without the check suffix. board is seen from the side to move,
+#moves are its legal moves.
+def san(board,move,moves,white):
+    flat=board.squares.ravel().tolist()
+    piece=flat[move.start]
+    if move.kind==castle:
+        return "O-O" if move.end&7==6 else "O-O-O"
+    text=""
+    if piece==1:
+        if move.captured:
+            text=squareName(move.start,white)[0]
+    else:
+        text=pieceLetters[piece]
+        others=[m.start for m in moves if m.end==move.end and m.start!=move.start and flat[m.start]==piece]
+        if others:
+            name=squareName(move.start,white)
+            if all(s&7!=move.start&7 for s in others):
+                text+=name[0]
+            elif all(s>>3!=move.start>>3 for s in others):
+                text+=name[1]
+            else:
+                text+=name
+    if move.captured:
+        text+="x"
+    text+=squareName(move.end,white)
+    if move.promotion:
+        text+="="+pieceLetters[move.promotion]
+    return text
+
+#plays one game. task is (index, FEN, white player spec, black player spec, seconds per move, maximum plies, seed).
+#returns a dict describing the game.
+def playGame(task):
+    index,fen,whiteSpec,blackSpec,timeLimit,maxPlies,seed=task
+    random.seed(seed)
+    players=[Player(whiteSpec),Player(blackSpec)]
+    white=len(fen.split())<2 or fen.split()[1]!="b"
+    board=fromFen(fen)
+    ai.table.clear()
+    seen={}
+    halfMoves=0
+    plies=0
+    moves=[]
+    latency={whiteSpec:[],blackSpec:[]}
+    while True:
+        legal=board.legalMoves()
+        inCheck=not board.isValid()
+        if moves and inCheck:
+            moves[-1]+="#" if not legal else "+"
+        if not legal:
+            if inCheck:
+                result,termination="0-1" if white else "1-0","checkmate"
+            else:
+                result,termination="1/2-1/2","stalemate"
+            break
+        if np.count_nonzero(board.squares)==2:
+            result,termination="1/2-1/2","insufficient material"
+            break
+        key=(white,board.hash)
+        seen[key]=seen.get(key,0)+1
+        if seen[key]>=3:
+            result,termination="1/2-1/2","threefold repetition"
+            break
+        if halfMoves>=100:
+            result,termination="1/2-1/2","fifty move rule"
+            break
+        if plies>=maxPlies:
+            result,termination="1/2-1/2","move limit"
+            break
+        player=players[0 if white else 1]
+        t=time.perf_counter()
+        move=player.choose(board,legal,timeLimit)
+        latency[player.spec].append(time.perf_counter()-t)
+        moves.append(san(board,move,legal,white))
+        if move.captured or board.squares.ravel()[move.start]==1:
+            halfMoves=0
+        else:
+            halfMoves+=1
+        board.make(move)
+        board.flip()
+        white=not white
+        plies+=1
+    return {"index":index,"fen":fen,"white":whiteSpec,"black":blackSpec,"result":result,"termination":termination,
+            "moves":moves,"latency":latency}
+
+#runs once in each worker process
+def initWorker(network):
+    if network:
+        ai.importTorch().set_num_threads(1) #one process per core already
+
+#returns the tasks for every game: each pair of players plays games games, on positions played twice with
+#the colours swapped.
+def makeTasks(specs,games,material,fens,timeLimit,maxPlies,seed):
+    rng=random.Random(seed)
+    tasks=[]
+    for i in range(len(specs)):
+        for j in range(i+1,len(specs)):
+            starts=fens if fens else [randomPosition(material,rng) for g in range((games+1)//2)]
+            for g in range(games):
+                fen=starts[(g//2)%len(starts)]
+                a,b=(specs[i],specs[j]) if g%2==0 else (specs[j],specs[i])
+                tasks.append((len(tasks),fen,a,b,timeLimit,maxPlies,seed+len(tasks)))
+    return tasks
+
+def runGames(tasks,workers):
+    if workers<=1:
+        return [playGame(task) for task in tasks]
+    players=[Player(spec) for spec in set(t[2] for t in tasks)|set(t[3] for t in tasks)]
+    network=any(p.model not in (None,"material") for p in players)
+    #spawned rather than forked workers, as in ai.getPool
+    with multiprocessing.get_context("spawn").Pool(workers,initWorker,(network,)) as pool:
+        games=list(pool.imap_unordered(playGame,tasks,chunksize=1))
+    return sorted(games,key=lambda game:game["index"])
+
+def toPgn(game):
+    headers=[("Event","Self-play tournament"),("Site","tournament.py"),("Round",str(game["index"]+1)),
+             ("White",game["white"]),("Black",game["black"]),("Result",game["result"]),
+             ("SetUp","1"),("FEN",game["fen"]),("Termination",game["termination"])]
+    text="".join("["+k+" \""+v+"\"]\n" for k,v in headers)+"\n"
+    white=game["fen"].split()[1]!="b"
+    number=1
+    words=[]
+    for i,move in enumerate(game["moves"]):
+        if white:
+            words.append(str(number)+".")
+        elif i==0:
+            words.append(str(number)+"...")
+        words.append(move)
+        if not white:
+            number+=1
+        white=not white
+    words.append(game["result"])
+    line=""
+    for word in words:
+        if len(line)+len(word)+1>80:
+            text+=line+"\n"
+            line=""
+        line+=(" " if line else "")+word
+    return text+line+"\n\n"
+
+#prints win/draw/loss statistics per player and per pairing, how the games ended and per move latency percentiles
+def report(games,specs):
+    stats={spec:[0,0,0] for spec in specs}
+    pairs={}
+    endings={}
+    latency={spec:[] for spec in specs}
+    for game in games:
+        w,b=game["white"],game["black"]
+        i={"1-0":0,"1/2-1/2":1,"0-1":2}[game["result"]] #index into win, draw, loss for white
+        stats[w][i]+=1
+        stats[b][2-i]+=1
+        first,second=(w,b) if specs.index(w)<specs.index(b) else (b,w)
+        pairs.setdefault((first,second),[0,0,0])[i if first==w else 2-i]+=1
+        endings[game["termination"]]=endings.get(game["termination"],0)+1
+        for spec,times in game["latency"].items():
+            latency[spec]+=times
+    print("player".ljust(32)+"games   win  draw  loss  score")
+    for spec in specs:
+        win,draw,loss=stats[spec]
+        n=win+draw+loss
+        print(spec.ljust(32)+str(n).rjust(5)+str(win).rjust(6)+str(draw).rjust(6)+str(loss).rjust(6)+
+              (str(round(100*(win+draw/2)/n,1))+"%").rjust(7))
+    for (a,b),(win,draw,loss) in pairs.items():
+        print(a+" vs "+b+": +"+str(win)+" ="+str(draw)+" -"+str(loss))
+    print("endings: "+", ".join(k+" "+str(v) for k,v in sorted(endings.items())))
+    print("player".ljust(32)+"moves   p50 ms   p90 ms   p99 ms   max ms")
+    for spec in specs:
+        times=np.array(latency[spec])*1000
+        if len(times)==0:
+            continue
+        p50,p90,p99=np.percentile(times,[50,90,99])
+        print(spec.ljust(32)+str(len(times)).rjust(5)+"".join(str(round(v,1)).rjust(9) for v in (p50,p90,p99,times.max())))
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Headless self-play tournament between chess bots.")
+    parser.add_argument("players",nargs="+",help="random, minimaxK, minimaxK@FILE or minimaxK@material")
+    parser.add_argument("--games",type=int,default=10,help="games per pair of players")
+    parser.add_argument("--material",default="KR",help="white's pieces in the random starting positions")
+    parser.add_argument("--fen",action="append",help="starting position (may be given more than once)")
+    parser.add_argument("--time",type=float,help="seconds per move for minimax players")
+    parser.add_argument("--max-plies",type=int,default=200)
+    parser.add_argument("--workers",type=int,default=multiprocessing.cpu_count())
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--pgn",help="file to write the games to")
+    args=parser.parse_args()
+    if len(set(args.players))!=len(args.players) or len(args.players)<2:
+        parser.error("at least two different players are needed")
+    for spec in args.players:
+        Player(spec) #raises on unknown players before any game starts
+    tasks=makeTasks(args.players,args.games,args.material,args.fen,args.time,args.max_plies,args.seed)
+    t=time.perf_counter()
+    games=runGames(tasks,args.workers)
+    print(str(len(games))+" games in "+str(round(time.perf_counter()-t,1))+"s")
+    report(games,args.players)
+    if args.pgn:
+        with open(args.pgn,"w") as f:
+            for game in games:
+                f.write(toPgn(game))
@@ -0,0 +1,67 @@
+import numpy as np
+
+'''
+Fixed-size transposition table for the search in ai.py, indexed by Board.hash.
+
+Each slot stores the full key, the depth searched, the score, what kind of bound the score is and the
+best move found (packed with Move.pack), in preallocated numpy arrays so the size in memory is fixed.
+A slot is replaced when the new entry is for the same position, was searched at least as deep, or the
+old entry is left over from an earlier search (see newSearch).
+'''
+
+#bound types
+exact=0
+lower=1 #the true value is at least the stored score
+upper=2 #the true value is at most the stored score
+
+class TranspositionTable:
+    dtypes=(np.uint64,np.int8,np.float32,np.int8,np.uint16,np.uint8) #key, depth, score, bound, move, age
+
+    def __init__(self,mb=16):
+        self.resize(mb)
+
+    #reallocates the table to use (at most) the given number of megabytes, clearing it.
+    def resize(self,mb):
+        entryBytes=sum(np.dtype(t).itemsize for t in TranspositionTable.dtypes)
+        n=max(1,int(mb*2**20)//entryBytes)
+        n=1<<(n.bit_length()-1) #round down to a power of two so slots can be found by masking
+        self.mask=n-1
+        self.keys,self.depths,self.scores,self.bounds,self.moves,self.ages=[np.zeros(n,dtype=t) for t in TranspositionTable.dtypes]
+        self.clear()
+
+    def __len__(self):
+        return self.mask+1
+
+    #empties the table -- call between games.
+    def clear(self):
+        for array in (self.keys,self.depths,self.scores,self.bounds,self.moves,self.ages):
+            array.fill(0)
+        self.age=0
+        self.probes=0
+        self.hits=0
+        self.stores=0
+
+    #marks all current entries as old, so they are the first to be replaced. Call before each search.
+    def newSearch(self):
+        self.age=(self.age+1)&255
+
+    #returns (depth, score, bound, packed move) stored for the given key, or None.
+    def probe(self,key):
+        self.probes+=1
+        i=key&self.mask
+        if int(self.keys[i])!=key:
+            return None
+        self.hits+=1
+        return (int(self.depths[i]),float(self.scores[i]),int(self.bounds[i]),int(self.moves[i]))
+
+    def store(self,key,depth,score,bound,move=0):
+        i=key&self.mask
+        if int(self.keys[i])!=key and self.ages[i]==self.age and self.depths[i]>depth:
+            return
+        self.stores+=1
+        self.keys[i]=key
+        self.depths[i]=depth
+        self.scores[i]=score
+        self.bounds[i]=bound
+        self.moves[i]=move
+        self.ages[i]=self.age
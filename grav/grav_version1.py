@@ -2,8 +2,11 @@ import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation as anim
 import matplotlib.animation as animation
 import os.path
-from math import sqrt,log
+from math import sqrt
 from random import random
+import numpy as np
+import mesh
+import snapshots
 
 
 ############################################################################
@@ -23,6 +26,14 @@ gravStr=0.00001 # Strength of gravity
 collideDist=0.05 # collisions register when objects are within this distance of each other
 nPoints=20 # Number of points to spawn
 speedLimit=None #limits the initial speed of points -- if set to None, initial points will begin with no velocity
+gravSolver="pairs" # "pairs" pulls each pair of points together every way around the wrapped grid; "mesh" uses a wrapped
+# mesh instead (see mesh.py): much faster with many points, but its pull falls off as 1/distance and is smoothed out
+# between points less than a couple of cells apart.
+meshSize=128 # Number of cells along each side of the mesh
+headless=False # If true, skips the animation and runs headlessSteps steps at full speed, saving a snapshot of the
+# points every snapshotEvery steps into a run folder to be rendered later (see snapshots.py)
+headlessSteps=3000
+snapshotEvery=10
 
 # needed for proper animation -- user might need to setup and/or find the appropriate folder on their machine.
 plt.rcParams["animation.ffmpeg_path"]='C:\\ffmpeg\\bin\\ffmpeg.exe'
@@ -177,6 +188,7 @@ class Point:
                 self.accel(x*a/d,y*a/d)
 
 fig,ax=plt.subplots()
+renderer=snapshots.Renderer(ax,gridSize) # draws all points as one scatter, updated in place every frame
 
 #creates points
 def populate():
@@ -192,34 +204,56 @@ def populate():
         m=1+random()*100
         Point(m,x,y,vx,vy)
     
-#simulates one step of the animation
-def step(i):
+#simulates one step of motion
+def advance():
     Point.collisionCheck()
     if len(Point.allPoints)<nPoints/2:
         populate()
-    ax.clear()
-    ax.set_xlim([-gridSize,gridSize])
-    ax.set_ylim([-gridSize,gridSize])
-    plots=[]
-    for point1 in Point.allPoints:
-        for point2 in Point.allPoints:
-            if point1!=point2:
-                point1.approach(point2)
+    if gravSolver=="mesh":
+        pos=np.array([[point.x,point.y] for point in Point.allPoints])
+        m=np.array([point.m for point in Point.allPoints])
+        acc=mesh.accelerations(pos,m,meshSize,2*gridSize,-gridSize,gravStr)
+    for n,point1 in enumerate(Point.allPoints):
+        if gravSolver=="mesh":
+            point1.accel(*acc[n])
+        else:
+            for point2 in Point.allPoints:
+                if point1!=point2:
+                    point1.approach(point2)
         point1.step()
-        plots.append(plt.plot(point1.x,point1.y,"r.",markersize=log(2*point1.m)))
-    return plots
+
+#simulates one step of the animation
+def step(i):
+    advance()
+    m=np.array([point.m for point in Point.allPoints])
+    return renderer.show([[point.x,point.y] for point in Point.allPoints],np.log(2*m),"r")
+
+#runs the simulation without drawing it, saving snapshots to render later
+def fastForward():
+    run=snapshots.newRun()
+    recorder=snapshots.Recorder(run,2,gridSize)
+    for i in range(headlessSteps):
+        advance()
+        if i%snapshotEvery==0:
+            m=np.array([point.m for point in Point.allPoints])
+            recorder.add(i,[[point.x,point.y] for point in Point.allPoints],m,np.log(2*m),"r")
+    recorder.close()
+    print("saved "+str(recorder.snapshots)+" snapshots to "+run+" -- render them with: python snapshots.py "+run)
 
 #carries out animation, and either saves or shows the graphic
 populate()
 
-wr=animation.writers["ffmpeg"]()
-a=anim(fig,step,interval=40,frames=300,repeat=True)
-
-if input("show? ")=="y":
-    plt.show()
+if headless:
+    fastForward()
 else:
-    n=0
-    while os.path.isfile("fig"+str(n)+".mp4"):
-        n+=1
-    fname="fig"+str(n)+".mp4"
-    a.save(fname,writer=wr,dpi=300)
+    wr=animation.writers["ffmpeg"]()
+    a=anim(fig,step,interval=40,frames=300,repeat=True,blit=True)
+
+    if input("show? ")=="y":
+        plt.show()
+    else:
+        n=0
+        while os.path.isfile("fig"+str(n)+".mp4"):
+            n+=1
+        fname="fig"+str(n)+".mp4"
+        a.save(fname,writer=wr,dpi=300)
@@ -3,8 +3,11 @@ from matplotlib.animation import FuncAnimation as anim
 import matplotlib.animation as animation
 import os.path
 import numpy as np
-from math import log,sqrt,pi,cos,sin
+from math import pi,cos,sin
 from random import randint, random, shuffle
+import barneshut
+import snapshots
+import integrators
 
 ############################################################################
 # Description:                                                             #
@@ -30,201 +33,335 @@ saveSeconds=20 # How long the animation should be when saved, in seconds
 fps=30 # Frames per second of the animation
 minExpMass=20 # Particles with mass less than this will never explode
 maxParticles=200 # Maximum number of particles allowed in the simulation
+tileSize=256 # Bodies handled at a time when adding up gravity; larger is faster but uses more memory
+gravSolver="direct" # "direct" adds up the pull of every pair of bodies; "tree" uses a Barnes-Hut tree (see barneshut.py), faster for thousands of bodies
+theta=0.5 # Opening angle of the tree solver: smaller is more accurate but slower
+integrator="euler" # How bodies are moved each step (see integrators.py): "euler" as originally; "leapfrog" or "yoshida" (4th order)
+# are far more accurate for the same timeStep; "block" gives each body its own step, shortened during close encounters
+timeStep=1.0 # Simulated time per step (collisions are only checked between steps, so long ones can let bodies pass through each other)
+blockLevels=8 # With "block", bodies take steps as short as timeStep/2**blockLevels
+blockAccuracy=0.002 # With "block", smaller keeps the bodies' steps shorter, for more accuracy
+driftEvery=0 # If above 0, prints every driftEvery steps how much energy and momentum the integrator has gained or lost
+# (collisions, which change both, are not counted; momentum is only conserved with no immovable bodies)
 distScale=True
+headless=False # If true, skips the animation and runs headlessSteps steps at full speed, saving a snapshot of the
+# bodies every snapshotEvery steps into a run folder to be rendered later (see snapshots.py)
+headlessSteps=6000
+snapshotEvery=10
 
 # needed for proper animation -- user might need to setup and/or find the appropriate folder on their machine.
 plt.rcParams["animation.ffmpeg_path"]='C:\\ffmpeg\\bin\\ffmpeg.exe'
 
 fig,ax=plt.subplots()
+renderer=snapshots.Renderer(ax,scale) # draws all bodies as one scatter, updated in place every frame
 
 """
-Class to store a single point.
+Class storing all bodies, as a structure of arrays: entry i of each array below belongs to body i.
+Bodies made with the constructor (see the Body Spawning section) are queued, and added to the arrays all at once at the
+start of the next step.
 
 Variables:
-list allBodies:
+np.array m:
     static variable
-    stores a list of all created Body objects
-list exempt:
+    mass of each body; used for draw size of the particle and gravitational force of the object
+np.array pos:
     static variable
-    stores a list of all Bodys that should be exempted from gravitational forces.
-float mass:
-    stores the mass of a Body; used for draw size of the particle and gravitational force of the object
-float x:
-    x-coordinate of Body's position vector
-float y:
-    y-coordinate of Body's position vector
-float xv:
-    x-coordinate of Body's velocity vector
-float yv:
-    y-coordinate of Body's velocity vector
-string color:
-    color the Body should be drawn with
-bool immoveable:
-    if true, the Body will never change its velocity
-    
+    (n,2) array of the bodies' position vectors
+np.array vel:
+    static variable
+    (n,2) array of the bodies' velocity vectors
+np.array color:
+    static variable
+    color each body should be drawn with
+np.array immovable:
+    static variable
+    true for bodies that will never change their velocity
+np.array exempt:
+    static variable
+    true for bodies created during the current step, which are exempted from collisions until the next step.
+list pending:
+    static variable
+    bodies made with the constructor since the last step, as (mass, x, y, xv, yv, color, immovable) tuples
+np.array acc:
+    static variable
+    (n,2) array of the bodies' accelerations at the end of the last step, if the integrator found them (otherwise None);
+    reset whenever bodies are added or removed
+np.array drift:
+    static variable
+    energy and momentum (x and y) gained by the bodies from the integrator so far, tracked with driftEvery
+int steps:
+    static variable
+    number of steps taken so far
+
 Methods:
-collsionCheck():
-    static method
-    checks all combinations of points for collisions, and carries them out with the collide method
-step():
-    static method
-    handles the movement and collisions of all bodies in a single step of the simulation.
 __init__(float mass, float xpos, float ypos, float xvel, float yvel, str color, bool immovable):
-    initializes a particle with given mass, position (posx, posy), and velocity (velx, vely)
+    queues a particle with given mass, position (posx, posy), and velocity (velx, vely)
     color indicates the color of the particle in the simulation
     particles with immovable set to true will not ever change their velocity away from their starting velocity.
-radius():
-    returns the particle's radius, as determined by its mass
-dist(Body other):
-    returns the distance from one body to another
-collideCheck(Body other):
-    checks for collision between one body and another, and carries out the collision if a collision takes place.
-    low velocity collisions result in bodies combining, while high velocity collisions result in explosions    
-combine(Body other):
-    combines two bodies together, intended to be used by collideCheck
-explode(float F):
-    explodes one body into many, where F indicates the force of the collision (and hence the speed of the resulting particles)
+add(m, pos, vel, color, immovable, exempt):
+    static method
+    appends bodies given as arrays, one entry per body
+keep(mask):
+    static method
+    removes the bodies where mask is false
+flush():
+    static method
+    adds the bodies queued by the constructor
+radius(m):
+    static method
+    returns the radius of bodies of the given masses
+gravity(np.array targets):
+    static method
+    returns the acceleration of the bodies with indices targets (every body by default) from the gravity of all the
+    others, a tile of tileSize bodies at a time (or from a Barnes-Hut tree, if gravSolver is "tree")
+touching():
+    static method
+    returns the pairs of bodies close enough to collide (found with a grid of cells rebuilt every step)
+collisions():
+    static method
+    carries out the collisions between touching bodies, each body colliding at most once per step. low velocity
+    collisions result in bodies combining, while high velocity collisions result in explosions
+explode(np.array e, np.array F, np.array counts):
+    static method
+    explodes the bodies with indices e into counts particles each, where F indicates the force of each collision (and
+    hence the speed of the resulting particles)
+integrate():
+    static method
+    moves all bodies forward by timeStep with the integrator chosen in the settings
+advance():
+    static method
+    handles the movement and collisions of all bodies in a single step of the simulation, printing the integrator's
+    drift every driftEvery steps.
+step():
+    static method
+    advances the simulation by a step and draws it, returning the artists changed
+sizes():
+    static method
+    returns the draw size of each body, as determined by its mass (and distance from the center, with distScale)
+shown():
+    static method
+    returns which bodies are close enough to the plot to be drawn
 draw():
-    draws the body to the plot
-move():
-    moves the particle in accordance with its current velocity
-gravForce(Body other):
-    accelerates a body in accordance with gravitational attraction from another body
-accel(float x, float y):
-    accelerates a body with vector (x, y)
+    static method
+    draws all bodies to the plot, returning the artists changed
 """
 class Body:
-    allBodies=[]
-    exempt=[] #exempt from collisions
+    m=np.zeros(0)
+    pos=np.zeros((0,2))
+    vel=np.zeros((0,2))
+    color=np.zeros(0,dtype="<U1")
+    immovable=np.zeros(0,dtype=bool)
+    exempt=np.zeros(0,dtype=bool) #exempt from collisions
+    pending=[]
+    acc=None
+    drift=np.zeros(3)
+    steps=0
+
+    def __init__(self,mass,xpos,ypos,xvel=0,yvel=0,color="r",immovable=False):
+        Body.pending.append((mass,xpos,ypos,xvel,yvel,color,immovable))
 
     @staticmethod
-    def collisions():
-        for body in [body for body in Body.allBodies if body not in Body.exempt]:
-            for target in[body for body in Body.allBodies if body not in Body.exempt]:
-                if body!=target:
-                    body.collideCheck(target)
+    def add(m,pos,vel,color,immovable,exempt):
+        Body.m=np.concatenate([Body.m,m])
+        Body.pos=np.concatenate([Body.pos,pos])
+        Body.vel=np.concatenate([Body.vel,vel])
+        Body.color=np.concatenate([Body.color,color])
+        Body.immovable=np.concatenate([Body.immovable,immovable])
+        Body.exempt=np.concatenate([Body.exempt,exempt])
+        Body.acc=None
 
     @staticmethod
-    def step():
-        Body.collisions()
-        for body in Body.allBodies:
-            if body in Body.exempt:
-                Body.exempt.remove(body)
-            for target in body.allBodies:
-                if body!=target:
-                    body.gravForce(target)
-            body.move()
-            body.draw()
-    
-    def __init__(self,mass,xpos,ypos,xvel=0,yvel=0,color="r",immovable=False):
-        self.m=mass
-        self.x=xpos
-        self.y=ypos
-        self.xv=xvel
-        self.yv=yvel
-        self.color=color
-        self.immovable=immovable
-        Body.allBodies.append(self)
-        Body.exempt.append(self)
+    def keep(mask):
+        Body.m=Body.m[mask]
+        Body.pos=Body.pos[mask]
+        Body.vel=Body.vel[mask]
+        Body.color=Body.color[mask]
+        Body.immovable=Body.immovable[mask]
+        Body.exempt=Body.exempt[mask]
+        Body.acc=None
 
-    def radius(self):
-        return sqrt(log(1+self.m))
+    @staticmethod
+    def flush():
+        if Body.pending:
+            m,x,y,xv,yv,color,immovable=zip(*Body.pending)
+            Body.add(np.array(m,dtype=float),np.column_stack([x,y]).astype(float),
+                     np.column_stack([xv,yv]).astype(float),np.array(color,dtype="<U1"),
+                     np.array(immovable,dtype=bool),np.ones(len(m),dtype=bool))
+            Body.pending=[]
 
-    def dist(self,other):
-        return sqrt((other.x-self.x)**2+(other.y-self.y)**2)
-    
-    def collideCheck(self,other):
-        if self.immovable and other.immovable:
-            return False
-        d=collisionDist*(self.radius()+other.radius())
-        if self.dist(other)<=d:
-            F=self.m*sqrt((self.xv-other.xv)**2+(self.yv-other.yv)**2)
-            m=max(self.m,other.m)
-            new=self.combine(other)
-            if F>new.m and new.m>minExpMass and (not (self.immovable or other.immovable)) and len(Body.allBodies)<=maxParticles:
-                new.explode(F)
-            return True
-        return False
+    @staticmethod
+    def radius(m):
+        return np.sqrt(np.log1p(m))
+
+    @staticmethod
+    def gravity(targets=None):
+        n=len(Body.m)
+        if targets is None:
+            targets=np.arange(n)
+        if gravSolver=="tree":
+            acc=barneshut.accelerations(Body.pos,Body.m,theta,gravConst)[targets]
+            acc[Body.immovable[targets]]=0
+            return acc
+        x,y=Body.pos.T
+        acc=np.zeros((len(targets),2))
+        for a in range(0,len(targets),tileSize):
+            t=targets[a:a+tileSize]
+            for b in range(0,n,tileSize):
+                # w[i,j]=m[j]/d[i,j]**2, and body i accelerates by the sum over j of w[i,j]*(pos[j]-pos[i])
+                w=np.subtract.outer(x[t],x[b:b+tileSize])**2
+                w+=np.subtract.outer(y[t],y[b:b+tileSize])**2
+                w[w==0]=np.inf # a body and itself (or another on top of it): pos[j]-pos[i] is 0, so it adds nothing
+                np.divide(Body.m[b:b+tileSize],w,out=w)
+                acc[a:a+tileSize]+=w@Body.pos[b:b+tileSize]-w.sum(axis=1)[:,None]*Body.pos[t]
+        acc*=gravConst
+        acc[Body.immovable[targets]]=0
+        return acc
+
+    @staticmethod
+    def touching():
+        idx=np.flatnonzero(~Body.exempt)
+        if len(idx)<2:
+            return np.zeros(0,dtype=int),np.zeros(0,dtype=int)
+        r=Body.radius(Body.m[idx])
+        # bodies are put in square cells at least as wide as the largest collision distance, so a body can only
+        # collide with bodies in its own cell or the 8 around it. The bodies of a cell are found by sorting by cell.
+        cell=2*collisionDist*r.max()
+        c=np.floor(Body.pos[idx]/cell).astype(np.int64)
+        key=(c[:,0]<<32)+c[:,1]
+        order=np.argsort(key,kind="stable")
+        sortedKey=key[order]
+        a=[]
+        b=[]
+        for dx in (-1,0,1):
+            for dy in (-1,0,1):
+                target=key+(dx<<32)+dy
+                lo=np.searchsorted(sortedKey,target,"left")
+                n=np.searchsorted(sortedKey,target,"right")-lo
+                first=np.repeat(np.arange(len(idx)),n)
+                second=order[np.repeat(lo-(np.cumsum(n)-n),n)+np.arange(n.sum())]
+                a.append(first[first<second]) # each pair once
+                b.append(second[first<second])
+        a=np.concatenate(a)
+        b=np.concatenate(b)
+        d=np.hypot(*(Body.pos[idx[a]]-Body.pos[idx[b]]).T)
+        hit=(d<=collisionDist*(r[a]+r[b]))&~(Body.immovable[idx[a]]&Body.immovable[idx[b]])
+        i=idx[a[hit]]
+        j=idx[b[hit]]
+        s=np.lexsort((j,i))
+        return i[s],j[s]
+
+    @staticmethod
+    def collisions():
+        i,j=Body.touching()
+        # pairs are taken in order, skipping bodies that have already collided (and so no longer exist), as if every
+        # body were checked against every other in turn
+        done=set()
+        pairs=[]
+        for a,b in zip(i.tolist(),j.tolist()):
+            if a not in done and b not in done:
+                done.add(a)
+                done.add(b)
+                pairs.append((a,b))
+        if not pairs:
+            return
+        i,j=np.array(pairs).T
+        mi=Body.m[i]
+        mj=Body.m[j]
+        m=mi+mj
+        pos=np.where((mj>mi)[:,None],Body.pos[j],Body.pos[i])
+        vel=(Body.vel[i]*mi[:,None]+Body.vel[j]*mj[:,None])/m[:,None]
+        vel=np.where(Body.immovable[j][:,None],Body.vel[j],vel)
+        vel=np.where(Body.immovable[i][:,None],Body.vel[i],vel)
+        ci=Body.color[i]
+        cj=Body.color[j]
+        color=np.where((np.random.random(len(m))<0.5)&(cj!="b")|(ci=="b"),cj,ci) # either color but "b", if possible
+        color=np.where(Body.immovable[j],cj,color)
+        color=np.where(Body.immovable[i],ci,color)
+        immovable=Body.immovable[i]|Body.immovable[j]
+        F=mi*np.hypot(*(Body.vel[i]-Body.vel[j]).T)
+        mask=np.ones(len(Body.m),dtype=bool)
+        mask[i]=False
+        mask[j]=False
+        Body.keep(mask)
+        first=len(Body.m)
+        Body.add(m,pos,vel,color,immovable,np.ones(len(m),dtype=bool))
+        # bodies explode while there are at most maxParticles, counting the particles of earlier explosions
+        n=len(Body.m)
+        e=[]
+        counts=[]
+        for k in np.flatnonzero((F>m)&(m>minExpMass)&~immovable).tolist():
+            if n<=maxParticles:
+                e.append(k)
+                counts.append(randint(minExpParticles,maxExpParticles))
+                n+=counts[-1]
+        if e:
+            Body.explode(first+np.array(e),F[e],np.array(counts))
+
+    @staticmethod
+    def explode(e,F,counts):
+        k=np.repeat(np.arange(len(e)),counts) # the explosion each particle comes from
+        share=np.repeat(Body.m[e]/counts,counts)
+        m=share/4+np.random.random(len(k))*share/4
+        # the radius of an exploding body shrinks as each particle takes its mass away
+        before=np.cumsum(m)-m
+        before-=np.repeat(before[np.cumsum(counts)-counts],counts)
+        c=collisionDist*(Body.radius(Body.m[e][k]-before)+np.log1p(m)**2)
+        offset=np.zeros((len(k),2))
+        redo=np.ones(len(k),dtype=bool)
+        while redo.any():
+            offset[redo]=np.random.random((redo.sum(),2))*4*c[redo][:,None]
+            redo=np.hypot(*offset.T)<=2*c
+        vel=Body.vel[e][k]+gravConst*offset*np.repeat(F,counts)[:,None]*(0.5-np.random.random((len(k),2)))
+        Body.m[e]-=np.bincount(k,m,len(e))
+        Body.add(m,Body.pos[e][k]+offset,vel,Body.color[e][k],np.zeros(len(k),dtype=bool),np.ones(len(k),dtype=bool))
 
-    def combine(self,other):
-        x=self.x
-        y=self.y
-        if self.immovable:
-            color=self.color
-        elif other.immovable:
-            color=other.color
+    @staticmethod
+    def integrate():
+        # the integrators move Body.pos and Body.vel in place, so Body.gravity sees the positions they reach
+        if integrator=="block":
+            Body.acc=integrators.block(Body.pos,Body.vel,Body.acc,Body.gravity,timeStep,blockLevels,blockAccuracy,
+                                       Body.radius(Body.m))
         else:
-            colors=[b.color for b in [self,other] if b.color!="b"]
-            if colors==[]:
-                color="b"
-            else:
-                shuffle(colors)
-                color=colors[0]
-        if other.m>self.m:
-            x=other.x
-            y=other.y
-        if self in Body.allBodies:
-            Body.allBodies.remove(self)
-        if other in Body.allBodies:
-            Body.allBodies.remove(other)
-        if self in Body.exempt:
-            Body.exempt.remove(self)
-        if other in Body.exempt:
-            Body.exempt.remove(other)
-        m=self.m+other.m
-        if self.immovable:
-            xv=self.xv
-            yv=self.yv
-        elif other.immovable:
-            xv=other.xv
-            yv=other.yv
+            Body.acc=integrators.methods[integrator](Body.pos,Body.vel,Body.acc,Body.gravity,timeStep)
+
+    @staticmethod
+    def advance():
+        Body.flush()
+        Body.collisions()
+        Body.exempt[:]=False
+        if driftEvery>0:
+            before=integrators.conserved(Body.pos,Body.vel,Body.m,gravConst,Body.immovable)
+            Body.integrate()
+            Body.drift+=integrators.conserved(Body.pos,Body.vel,Body.m,gravConst,Body.immovable)-before
         else:
-            xv=self.xv*self.m/m+other.xv*other.m/m
-            yv=self.yv*self.m/m+other.yv*other.m/m
-        return Body(m,x,y,xv,yv,color,(self.immovable or other.immovable))
+            Body.integrate()
+        Body.steps+=1
+        if driftEvery>0 and Body.steps%driftEvery==0:
+            moving=~Body.immovable
+            kinetic=(Body.m[moving]*(Body.vel[moving]**2).sum(axis=1)).sum()/2
+            print("step "+str(Body.steps)+": energy drift "+("%.2e"%Body.drift[0])+" ("+("%.1e"%(Body.drift[0]/kinetic))+
+                  " of the kinetic energy), momentum drift "+("%.2e"%np.hypot(Body.drift[1],Body.drift[2])))
 
-    def explode(self,F):
-        particles=randint(minExpParticles,maxExpParticles)
-        minSize=self.m/(4*particles)
-        maxSize=self.m/(2*particles)
-        for p in range(particles):
-            m=minSize+random()*(maxSize-minSize)
-            x=self.x
-            y=self.y
-            while sqrt((x-self.x)**2+(y-self.y)**2)<=collisionDist*(self.radius()+log(1+m)**2)*2:
-                x=self.x+random()*collisionDist*(self.radius()+log(1+m)**2)*4
-                y=self.y+random()*collisionDist*(self.radius()+log(1+m)**2)*4
-            dx=self.x-x
-            dy=self.y-y
-            Body(m,x,y,self.xv-gravConst*dx*F*(0.5-random()),self.yv-gravConst*dy*F*(0.5-random()),self.color)
-            self.m-=m
-        
-    def draw(self):
-        if abs(self.x)<scale or abs(self.y)<scale:
-            size=log(self.m+1)
-            if distScale:
-                sc=((self.x/scale)**2+(self.y/scale)**2)*3
-                size=size*(1+sc)
-            return plt.plot(self.x,self.y,self.color+".",markersize=size)
+    @staticmethod
+    def step():
+        Body.advance()
+        return Body.draw()
 
-    def move(self):
-        self.x+=self.xv
-        self.y+=self.yv
+    @staticmethod
+    def sizes():
+        size=np.log(Body.m+1)
+        if distScale:
+            size=size*(1+((Body.pos[:,0]/scale)**2+(Body.pos[:,1]/scale)**2)*3)
+        return size
 
-    def gravForce(self,other):
-        if self.immovable:
-            return
-        xd=other.x-self.x
-        yd=other.y-self.y
-        d=self.dist(other)
-        if d==0:
-            d=0.0001
-        F=gravConst*other.m/(d**2)
-        self.accel(xd*F,yd*F)
+    @staticmethod
+    def shown():
+        return (np.abs(Body.pos[:,0])<scale)|(np.abs(Body.pos[:,1])<scale)
 
-    def accel(self,x,y):
-        self.xv+=x
-        self.yv+=y
+    @staticmethod
+    def draw():
+        shown=Body.shown()
+        return renderer.show(Body.pos[shown],Body.sizes()[shown],Body.color[shown])
 
 colors=["b","g","r","c","m","y"] #colors allowed for bodies
 
@@ -309,20 +446,31 @@ for k in range(120):
 
 # simulates one step of animation
 def sketch(i):
-    ax.clear()
-    ax.set_xlim([-scale,scale])
-    ax.set_ylim([-scale,scale])
-    Body.step()
-    return []
+    return Body.step()
+
+# runs the simulation without drawing it, saving snapshots to render later
+def fastForward():
+    run=snapshots.newRun()
+    recorder=snapshots.Recorder(run,2,scale)
+    for i in range(headlessSteps):
+        Body.advance()
+        if i%snapshotEvery==0:
+            shown=Body.shown()
+            recorder.add(i,Body.pos[shown],Body.m[shown],Body.sizes()[shown],Body.color[shown])
+    recorder.close()
+    print("saved "+str(recorder.snapshots)+" snapshots to "+run+" -- render them with: python snapshots.py "+run)
 
 #handles the animation and simulation.
-wr=animation.writers["ffmpeg"](fps=fps)
-anim=anim(fig,sketch,interval=40,frames=saveSeconds*fps,repeat=True)
-i=input("show? ")
-if i.lower()=='y':
-    plt.show()
+if headless:
+    fastForward()
 else:
-    n=0
-    while os.path.isfile("fig"+str(n)+".mp4"):
-        n+=1
-    anim.save('fig'+str(n)+".mp4",dpi=300,writer=wr)
+    wr=animation.writers["ffmpeg"](fps=fps)
+    anim=anim(fig,sketch,interval=40,frames=saveSeconds*fps,repeat=True,blit=True)
+    i=input("show? ")
+    if i.lower()=='y':
+        plt.show()
+    else:
+        n=0
+        while os.path.isfile("fig"+str(n)+".mp4"):
+            n+=1
+        anim.save('fig'+str(n)+".mp4",dpi=300,writer=wr)
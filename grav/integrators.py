@@ -0,0 +1,175 @@
+import time
+import argparse
+import numpy as np
+
+############################################################################
+# Description:                                                             #
+# Integrators for grav_version2: the ways of moving bodies forward in      #
+# time from their accelerations. Each one updates the positions and        #
+# velocities of the bodies in place over a step of time dt:                #
+#     euler     - the original update, velocity then position; 1st order  #
+#     leapfrog  - kick, drift, kick (velocity Verlet); 2nd order           #
+#     yoshida   - three leapfrog steps of tuned lengths; 4th order         #
+#     block     - leapfrog where each body takes its own step, a power of  #
+#                 two fraction of dt, shorter where it is pulled hardest   #
+# Run this file for a report of the energy and momentum each one loses    #
+# on a disk around a heavy center, like grav_version2's default.           #
+############################################################################
+
+# Every integrator takes accel, a function returning the accelerations of the bodies at the rows targets (all of them
+# by default) at their current positions -- the positions the integrator updates in place -- and acc, the
+# accelerations at the start of the step if they are known (or None). Each returns the accelerations at the end of the
+# step if it found them (or None), to be passed back in as acc on the next step so they are not worked out twice.
+
+#the original update: every velocity changes by the acceleration at the start of the step, then every position by
+#the new velocity
+def euler(pos,vel,acc,accel,dt):
+    if acc is None:
+        acc=accel()
+    vel+=acc*dt
+    pos+=vel*dt
+    return None
+
+#a half step kick of the velocities, a full step drift of the positions, and a second half step kick with the
+#accelerations at the new positions: one evaluation of the accelerations per step, given the last step's
+def leapfrog(pos,vel,acc,accel,dt):
+    if acc is None:
+        acc=accel()
+    vel+=acc*(dt/2)
+    pos+=vel*dt
+    acc=accel()
+    vel+=acc*(dt/2)
+    return acc
+
+# Yoshida's weights: leapfrog steps of w1, w0 and w1 times dt, w0 being negative, cancel each other's errors up to
+# the 4th order
+w1=1/(2-2**(1/3))
+w0=-2**(1/3)*w1
+
+#three leapfrog steps with Yoshida's weights: three evaluations of the accelerations per step
+def yoshida(pos,vel,acc,accel,dt):
+    for w in (w1,w0,w1):
+        acc=leapfrog(pos,vel,acc,accel,w*dt)
+    return acc
+
+#returns the level of the step each body should take, its step being dt/2**level: the smallest level (up to levels)
+#for which the step is below sqrt(2*eta*length/|acc|), the time the acceleration takes to move the body by eta
+#times its length (in grav_version2, its radius). Unpulled bodies take whole steps.
+def stepLevels(acc,dt,levels,eta,lengths):
+    with np.errstate(divide="ignore"):
+        want=np.sqrt(2*eta*lengths/np.sqrt((acc**2).sum(axis=1)))
+        level=np.ceil(np.log2(dt/want))
+    return np.clip(level,0,levels).astype(np.int64)
+
+#leapfrog with block (hierarchical) timesteps. The step dt is split into 2**levels ticks, and body i takes steps of
+#span[i] ticks, a power of two, so that every body's steps line up with those of all bodies taking longer ones.
+#At each tick where some bodies' steps end, every body drifts up to it, and only the bodies whose steps end have
+#their accelerations worked out, finishing their steps with a half kick and starting new ones with another. A body
+#can shorten its step whenever one ends, but only lengthen it to a step that starts on that tick of the longer
+#steps' grid. With few bodies in close encounters, most of the work is done on them alone.
+def block(pos,vel,acc,accel,dt,levels,eta,lengths):
+    if acc is None:
+        acc=accel()
+    ticks=1<<levels
+    h=dt/ticks
+    span=1<<(levels-stepLevels(acc,dt,levels,eta,lengths))
+    t=0
+    while t<ticks:
+        start=t%span==0
+        vel[start]+=acc[start]*(span[start]*h/2)[:,None]
+        shortest=span.min()
+        pos+=vel*((shortest-t%shortest)*h)
+        t+=shortest-t%shortest
+        end=np.flatnonzero(t%span==0)
+        acc[end]=accel(end)
+        vel[end]+=acc[end]*(span[end]*h/2)[:,None]
+        # the longest step starting at tick t, which lines up with all longer ones
+        aligned=levels-((int(t)&-int(t)).bit_length()-1)
+        span[end]=1<<(levels-np.maximum(stepLevels(acc[end],dt,levels,eta,lengths[end]),aligned))
+    return acc
+
+methods={"euler":euler,"leapfrog":leapfrog,"yoshida":yoshida}
+
+#returns the total energy of the bodies and their total momentum, as an array (energy, momentum x, momentum y), for
+#grav_version2's law (acceleration G*m/d towards each body, so the potential energy of a pair is G*m1*m2*log(d)).
+#Immovable bodies are left out of the kinetic energy and momentum, and pairs of them out of the potential energy:
+#with them at rest, the energy is conserved, and with none, the momentum is too. Pairs are summed tile at a time.
+def conserved(pos,vel,m,G,immovable,tile=256):
+    moving=~immovable
+    energy=(m[moving]*(vel[moving]**2).sum(axis=1)).sum()/2
+    for a in range(0,len(m),tile):
+        for b in range(a,len(m),tile):
+            d2=np.subtract.outer(pos[a:a+tile,0],pos[b:b+tile,0])**2
+            d2+=np.subtract.outer(pos[a:a+tile,1],pos[b:b+tile,1])**2
+            pair=np.outer(m[a:a+tile],m[b:b+tile])*np.log(np.where(d2>0,d2,1))/2
+            pair[np.logical_and.outer(immovable[a:a+tile],immovable[b:b+tile])]=0
+            energy+=G*(np.triu(pair,1).sum() if a==b else pair.sum()) # each pair once
+    momentum=(m[moving,None]*vel[moving]).sum(axis=0)
+    return np.array([energy,momentum[0],momentum[1]])
+
+#returns positions, velocities and masses for n bodies circling a center of mass 10000 on orbits that can dive close to
+#it, like grav_version2's default setup. The bodies are a thousand times lighter than there, so that their rare close
+#passes by each other, which end in collisions in grav_version2, do not swamp the drift of the integrators.
+def disk(n,seed=0):
+    rng=np.random.default_rng(seed)
+    r=rng.random(n)*10+40
+    th=rng.random(n)*2*np.pi
+    thv=th+np.pi/2+rng.random(n)*np.pi/2-np.pi/4
+    v=rng.random(n)*1.4+0.05
+    pos=np.column_stack([r*np.cos(th),r*np.sin(th)])
+    vel=np.column_stack([v*np.cos(thv),v*np.sin(thv)])
+    m=(20+rng.random((n,3)).sum(axis=1)*10)/1000
+    pos[0]=0
+    vel[0]=0
+    m[0]=10000
+    return pos,vel,m
+
+#returns the accelerations of the bodies at rows targets (all by default) of pos from all bodies, for the report
+def pull(pos,m,G,targets=None):
+    if targets is None:
+        targets=np.arange(len(pos))
+    d=pos[None,:,:]-pos[targets,None,:]
+    d2=(d**2).sum(axis=2)
+    d2[d2==0]=np.inf
+    return G*((m/d2)[:,:,None]*d).sum(axis=1)
+
+#prints, for each integrator and step, how far the energy and momentum of a disk of n bodies have drifted after
+#moving it for a time duration: the largest change in energy along the way as a fraction of the starting kinetic
+#energy, and the change in momentum as a fraction of the sum of the bodies' momenta. Also prints the accelerations
+#worked out per body per unit of time, the cost of the integrator, and the time taken.
+def report(n=120,duration=600,runs=(("euler",1),("leapfrog",1),("leapfrog",0.25),("yoshida",1),("yoshida",0.25),
+                                   ("block",1),("block",4)),levels=8,eta=0.002,G=0.0001):
+    print("integrator   step  evaluations  energy drift  momentum drift  time(s)")
+    for name,dt in runs:
+        pos,vel,m=disk(n)
+        immovable=np.zeros(n,dtype=bool)
+        lengths=np.full(n,2.0) # about the radius of grav_version2's bodies
+        count=[0]
+        def accel(targets=None):
+            count[0]+=n if targets is None else len(targets)
+            return pull(pos,m,G,targets)
+        start=conserved(pos,vel,m,G,immovable)
+        kinetic=(m*(vel**2).sum(axis=1)).sum()/2
+        scale=(m*np.sqrt((vel**2).sum(axis=1))).sum()
+        worst=0
+        acc=None
+        t=time.perf_counter()
+        for i in range(int(round(duration/dt))):
+            if name=="block":
+                acc=block(pos,vel,acc,accel,dt,levels,eta,lengths)
+            else:
+                acc=methods[name](pos,vel,acc,accel,dt)
+            worst=max(worst,abs(conserved(pos,vel,m,G,immovable)[0]-start[0]))
+        t=time.perf_counter()-t
+        drift=conserved(pos,vel,m,G,immovable)-start
+        print(name.ljust(10)+str(dt).rjust(7)+("%.1f"%(count[0]/n/duration)).rjust(13)+("%.1e"%(worst/kinetic)).rjust(14)+
+              ("%.1e"%(np.hypot(drift[1],drift[2])/scale)).rjust(16)+("%.2f"%t).rjust(9))
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Energy and momentum drift of the grav_version2 integrators.")
+    parser.add_argument("--bodies",type=int,default=120)
+    parser.add_argument("--duration",type=float,default=600,help="simulated time to run each integrator for")
+    parser.add_argument("--levels",type=int,default=8,help="block timesteps go down to a step/2**levels")
+    parser.add_argument("--eta",type=float,default=0.002,help="accuracy of the block timesteps (see stepLevels)")
+    args=parser.parse_args()
+    report(args.bodies,args.duration,levels=args.levels,eta=args.eta)
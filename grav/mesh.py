@@ -0,0 +1,122 @@
+import time
+import argparse
+import numpy as np
+
+############################################################################
+# Description:                                                             #
+# Particle-mesh gravity on a periodic square, for grav_version1's wrapped  #
+# grid. Masses are spread onto an n by n grid of cells (cloud in cell),    #
+# the potential is found from Poisson's equation with a fast Fourier       #
+# transform -- which is periodic, so the grid wraps exactly like the       #
+# simulation -- and the pull at each cell is read back at the particles.   #
+# A step costs about N + n^2 log n rather than N^2. Run this file for a    #
+# check of its accuracy and speed.                                         #
+############################################################################
+
+# In 2D, Poisson's equation (laplacian of the potential = 2*pi*G*density) gives a particle of mass m a pull of G*m/d at
+# distance d, as in grav_version2. Forces between particles less than a couple of cells apart are smoothed out, and
+# the pulls are relative to the mean density of the square (its uniform part pulls nowhere, by symmetry).
+
+#returns, for particles at positions pos ((N,2) array) in the square of width size starting at lo, the flattened
+#indices of the 4 cells each one is spread over and their weights, as (N,4) arrays
+def cells(pos,n,size,lo):
+    u=(pos-lo)*(n/size)-0.5 # in cells, from the center of the first cell
+    i=np.floor(u).astype(np.int64)
+    f=u-i
+    ix=np.stack([i[:,0],i[:,0]+1,i[:,0],i[:,0]+1],axis=1)%n
+    iy=np.stack([i[:,1],i[:,1],i[:,1]+1,i[:,1]+1],axis=1)%n
+    wx=np.stack([1-f[:,0],f[:,0],1-f[:,0],f[:,0]],axis=1)
+    wy=np.stack([1-f[:,1],1-f[:,1],f[:,1],f[:,1]],axis=1)
+    return ix*n+iy,wx*wy
+
+#returns the mass in each cell (an (n,n) array, indexed [x][y]) of particles with the given cells and weights
+def deposit(index,weights,m,n):
+    return np.bincount(index.ravel(),(weights*m[:,None]).ravel(),n*n).reshape(n,n)
+
+#returns the potential at each cell (an (n,n) array) from the mass in each cell, solving Poisson's equation in
+#Fourier space
+def potential(grid,size,G):
+    n=len(grid)
+    h=size/n
+    kx=2*np.pi*np.fft.fftfreq(n,h)[:,None]
+    ky=2*np.pi*np.fft.rfftfreq(n,h)[None,:]
+    k2=kx**2+ky**2
+    k2[0,0]=1
+    phi=-2*np.pi*G*np.fft.rfft2(grid/h**2)/k2
+    phi[0,0]=0
+    return np.fft.irfft2(phi,(n,n))
+
+#returns the accelerations of particles with positions pos ((N,2) array) and masses m in the periodic square of width
+#size starting at lo (in both directions), using an n by n mesh.
+def accelerations(pos,m,n=128,size=1.0,lo=0.0,G=1.0):
+    index,weights=cells(pos,n,size,lo)
+    phi=potential(deposit(index,weights,m,n),size,G)
+    acc=np.zeros(pos.shape)
+    for k in range(2):
+        # the pull is the slope of the potential across the neighbouring cells (differentiating in Fourier space
+        # instead rings at the scale of the cells)
+        field=(np.roll(phi,1,k)-np.roll(phi,-1,k))*(n/(2*size))
+        acc[:,k]=(field.ravel()[index]*weights).sum(axis=1) # read back with the same weights, so no particle pulls itself
+    return acc
+
+#returns the accelerations of particles (for targets, all of them by default) from the 1/d law summed over every image
+#of the square, with no smoothing: an Ewald sum, splitting each pull into a short range part summed over the nearest
+#images and a smooth remainder summed as a Fourier series.
+def exact(pos,m,size=1.0,G=1.0,targets=None):
+    if targets is None:
+        targets=np.arange(len(pos))
+    alpha=6/size # the short range part falls off as exp(-(alpha*d)**2)
+    acc=np.zeros((len(targets),2))
+    for t,i in enumerate(targets):
+        d=(pos-pos[i]+size/2)%size-size/2
+        for x in (-size,0,size):
+            for y in (-size,0,size):
+                dx=d[:,0]+x
+                dy=d[:,1]+y
+                d2=dx**2+dy**2
+                d2[d2==0]=np.inf
+                w=m*np.exp(-alpha**2*d2)/d2
+                acc[t]+=[(w*dx).sum(),(w*dy).sum()]
+    k=2*np.pi/size*np.arange(-12,13)
+    kx,ky=[a.ravel() for a in np.meshgrid(k,k)]
+    keep=(kx!=0)|(ky!=0)
+    kx=kx[keep]
+    ky=ky[keep]
+    k2=kx**2+ky**2
+    rho=np.exp(-1j*(np.outer(pos[:,0],kx)+np.outer(pos[:,1],ky))).T@m # Fourier coefficients of the point masses
+    phi=-2*np.pi*rho/k2*np.exp(-k2/(4*alpha**2))/size**2
+    phase=np.exp(1j*(np.outer(pos[targets,0],kx)+np.outer(pos[targets,1],ky)))
+    acc+=np.stack([(phase@(-1j*kx*phi)).real,(phase@(-1j*ky*phi)).real],axis=1)
+    return G*acc
+
+#returns positions and masses for n particles in clumps of width spread at random places in the unit square
+def clumps(n,count=10,spread=0.05,seed=0):
+    rng=np.random.default_rng(seed)
+    centers=rng.random((count,2))
+    pos=(centers[rng.integers(0,count,n)]+rng.normal(0,spread,(n,2)))%1
+    return pos,rng.uniform(1,100,n)
+
+#prints the error of the mesh's accelerations against exact for particles in clumps, and the time a step takes.
+#The large errors are on particles whose pull comes mostly from neighbours a cell or two away, which the mesh smooths out.
+def report(sizes=(1000,10000,100000),meshes=(64,128,256),sample=200):
+    print("particles  mesh  time(s)  median err  99% err")
+    for N in sizes:
+        pos,m=clumps(N)
+        rng=np.random.default_rng(1)
+        check=rng.choice(N,min(sample,N),replace=False)
+        ref=exact(pos,m,targets=check)
+        norm=np.sqrt((ref**2).sum(axis=1))
+        for n in meshes:
+            t=time.perf_counter()
+            acc=accelerations(pos,m,n)
+            dt=time.perf_counter()-t
+            err=np.sqrt(((acc[check]-ref)**2).sum(axis=1))/norm
+            print(str(N).rjust(9)+str(n).rjust(6)+("%.3f"%dt).rjust(9)+("%.1e"%np.median(err)).rjust(12)+
+                  ("%.1e"%np.percentile(err,99)).rjust(9))
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Accuracy and speed of particle-mesh gravity.")
+    parser.add_argument("--sizes",type=int,nargs="+",default=[1000,10000,100000])
+    parser.add_argument("--meshes",type=int,nargs="+",default=[64,128,256])
+    args=parser.parse_args()
+    report(args.sizes,args.meshes)
@@ -0,0 +1,209 @@
+import os
+import json
+import argparse
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation as anim
+import matplotlib.animation as animation
+from matplotlib.collections import EllipseCollection
+from matplotlib.colors import to_rgba_array
+
+############################################################################
+# Description:                                                             #
+# Recording and rendering of headless grav runs. With headless set, a      #
+# simulation skips the animation and runs its physics at full speed,       #
+# saving every few steps a snapshot of its bodies into a run folder. The   #
+# folder can then be rendered to a video (or to still frames) at any       #
+# resolution, as often as wanted, without running the simulation again:   #
+#                                                                          #
+#     python snapshots.py run0 [--out run0.mp4] [--dpi 300] [--fps 30]     #
+#     python snapshots.py run0 --frames frames/ [--every 10]               #
+############################################################################
+
+# A run folder holds:
+#   info.json   the settings the renderer needs: dimensions, axis scale, and whether sizes are in points or data units
+#   bodies.bin  every body of every snapshot, one after another (see bodyType), appended as the run goes
+#   frames.bin  one (step, start, count) record per snapshot (see frameType): its bodies are bodies[start:start+count]
+# Both files are only ever appended to, so a run can be rendered while it is still being recorded.
+
+# needed for saving videos -- user might need to setup and/or find the appropriate folder on their machine.
+plt.rcParams["animation.ffmpeg_path"]='C:\\ffmpeg\\bin\\ffmpeg.exe'
+
+frameType=np.dtype([("step","<i8"),("start","<i8"),("count","<i8")])
+
+#the record of a single body: its position, mass, draw size and color (a matplotlib color letter)
+def bodyType(dim):
+    return np.dtype([("pos","<f8",(dim,)),("m","<f8"),("size","<f4"),("color","S1")])
+
+"""
+Class to write snapshots of a simulation into a run folder.
+
+Variables:
+str path:
+    the run folder
+int dim:
+    number of dimensions of the positions
+int count:
+    number of bodies written so far
+int snapshots:
+    number of snapshots written so far
+
+Methods:
+__init__(str path, int dim, float scale, str units):
+    creates the run folder. scale is the half-width of the area drawn (as in the simulations); units says whether
+    sizes are marker sizes in "points" or radii in "data" units
+add(int step, np.array pos, np.array m, np.array size, np.array color):
+    appends a snapshot of the bodies at the given step: (n,dim) positions and one mass, size and color for each
+close():
+    closes the files
+"""
+class Recorder:
+    def __init__(self,path,dim,scale,units="points"):
+        os.makedirs(path,exist_ok=True)
+        self.path=path
+        self.dim=dim
+        with open(os.path.join(path,"info.json"),"w") as f:
+            json.dump({"dim":dim,"scale":scale,"units":units},f)
+        self.bodies=open(os.path.join(path,"bodies.bin"),"wb")
+        self.frames=open(os.path.join(path,"frames.bin"),"wb")
+        self.count=0
+        self.snapshots=0
+
+    def add(self,step,pos,m,size,color):
+        records=np.zeros(len(m),dtype=bodyType(self.dim))
+        records["pos"]=np.reshape(pos,(-1,self.dim))
+        records["m"]=m
+        records["size"]=size
+        records["color"]=color
+        records.tofile(self.bodies)
+        np.array([(step,self.count,len(m))],dtype=frameType).tofile(self.frames)
+        self.count+=len(m)
+        self.snapshots+=1
+        self.bodies.flush()
+        self.frames.flush()
+
+    def close(self):
+        self.bodies.close()
+        self.frames.close()
+
+"""
+Class to read the snapshots of a run folder, memory mapped.
+
+Variables:
+dict info:
+    the settings saved by Recorder
+np.array frames:
+    the (step, start, count) record of each snapshot
+np.array bodies:
+    the bodies of all snapshots
+
+Methods:
+__init__(str path):
+    opens the run folder
+__len__():
+    returns the number of snapshots
+__getitem__(int i):
+    returns the step number and the bodies of snapshot i
+"""
+class Snapshots:
+    def __init__(self,path):
+        with open(os.path.join(path,"info.json")) as f:
+            self.info=json.load(f)
+        self.frames=load(os.path.join(path,"frames.bin"),frameType)
+        self.bodies=load(os.path.join(path,"bodies.bin"),bodyType(self.info["dim"]))
+        # a run still being recorded can have a last snapshot whose bodies are not all written yet
+        while len(self.frames) and self.frames[-1]["start"]+self.frames[-1]["count"]>len(self.bodies):
+            self.frames=self.frames[:-1]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self,i):
+        step,start,count=self.frames[i].tolist()
+        return step,self.bodies[start:start+count]
+
+#memory maps a file of records, allowing for an empty file and for a last record that is only partly written
+def load(path,dtype):
+    n=os.path.getsize(path)//dtype.itemsize
+    if n==0:
+        return np.zeros(0,dtype=dtype)
+    return np.memmap(path,dtype=dtype,mode="r",shape=(n,))
+
+"""
+Class to draw bodies onto a matplotlib axes with a single artist, kept from frame to frame: each frame only changes its
+positions, sizes and colors, so drawing takes about the same time however many bodies there are. Used for the live
+animations of the simulations as well as for rendering runs.
+
+Methods:
+__init__(ax, float scale, str units):
+    sets up the axes to show the square of half-width scale around the center. units says whether sizes are marker
+    sizes in "points" (drawn as a scatter) or radii in "data" units (drawn as circles)
+show(np.array pos, np.array size, color):
+    shows bodies with the given (n,2) positions (further coordinates are ignored), sizes and colors (one matplotlib
+    color letter, or one for each body), returning the artists changed
+draw(np.array bodies):
+    shows bodies from a snapshot, returning the artists changed
+"""
+class Renderer:
+    def __init__(self,ax,scale,units="points"):
+        self.units=units
+        ax.set_xlim([-scale,scale])
+        ax.set_ylim([-scale,scale])
+        if units=="data":
+            self.artist=EllipseCollection([],[],[],units="xy",offsets=np.zeros((0,2)),offset_transform=ax.transData)
+            ax.add_collection(self.artist)
+        else:
+            self.artist=ax.scatter([],[],marker=".")
+
+    def show(self,pos,size,color):
+        pos=np.asarray(pos,dtype=float) if len(size) else np.zeros((0,2))
+        size=np.asarray(size,dtype=float)
+        self.artist.set_offsets(pos[:,:2])
+        if self.units=="data":
+            self.artist.set_widths(2*size)
+            self.artist.set_heights(2*size)
+            self.artist.set_angles(np.zeros(len(size)))
+        else:
+            self.artist.set_sizes(size**2)
+        # colors are converted once for each different letter, not once for each body
+        letters,index=np.unique(np.broadcast_to(np.asarray(color,dtype=str),(len(size),)),return_inverse=True)
+        self.artist.set_color(to_rgba_array(letters)[index])
+        return [self.artist]
+
+    def draw(self,bodies):
+        return self.show(bodies["pos"],bodies["size"],bodies["color"].astype(str))
+
+#renders the snapshots of the run folder at path (every every-th one) to a video at out, or to numbered PNG files in
+#the folder frames if it is given
+def render(path,out=None,frames=None,every=1,fps=30,dpi=300):
+    run=Snapshots(path)
+    fig,ax=plt.subplots()
+    renderer=Renderer(ax,run.info["scale"],run.info["units"])
+    shown=range(0,len(run),every)
+    if frames!=None:
+        os.makedirs(frames,exist_ok=True)
+        for n,i in enumerate(shown):
+            renderer.draw(run[i][1])
+            fig.savefig(os.path.join(frames,"frame"+str(n).zfill(5)+".png"),dpi=dpi)
+        return len(shown)
+    a=anim(fig,lambda n:renderer.draw(run[shown[n]][1]),frames=len(shown),blit=True)
+    a.save(out or path.rstrip("/\\")+".mp4",dpi=dpi,writer=animation.writers["ffmpeg"](fps=fps))
+    return len(shown)
+
+#returns the first folder name of the form run0, run1, ... that does not exist yet
+def newRun():
+    n=0
+    while os.path.exists("run"+str(n)):
+        n+=1
+    return "run"+str(n)
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Render the snapshots of a headless grav run.")
+    parser.add_argument("run",help="the run folder")
+    parser.add_argument("--out",help="video file to write (the run folder's name with .mp4 by default)")
+    parser.add_argument("--frames",help="folder to write PNG frames to instead of a video")
+    parser.add_argument("--every",type=int,default=1,help="render only every n-th snapshot")
+    parser.add_argument("--fps",type=int,default=30)
+    parser.add_argument("--dpi",type=int,default=300)
+    args=parser.parse_args()
+    print(str(render(args.run,args.out,args.frames,args.every,args.fps,args.dpi))+" frames")